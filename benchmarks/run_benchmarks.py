@@ -0,0 +1,375 @@
+"""
+run_benchmarks.py - Offline Benchmarks for the Canary Router and Model Server
+
+Runs entirely in-process: Flask test clients instead of HTTP, and a small
+locally trained sentiment pipeline served through a stand-in for the
+MLflow registry, so no MLflow server, Kubernetes or network is needed.
+
+Benchmarks:
+  router_predict            /predict throughput and p50/p99 (module 1)
+  router_metrics_scrape     /metrics cost as recorded predictions grow
+  router_routing            WeightedRouter.route() cost per call
+  router_check_rollback     /check_rollback and RollbackEvaluator.evaluate() cost
+  server_predict            /predict throughput and p50/p99 (module 3, sleeps removed)
+  server_metrics_scrape     Prometheus /metrics cost as requests grow
+
+Each measurement is repeated and the median kept. Results are compared
+with a JSON baseline and the run fails (exit code 1) when any metric is
+worse than the baseline by more than the tolerance.
+
+Usage:
+  python benchmarks/run_benchmarks.py --update-baseline   # Record a baseline
+  python benchmarks/run_benchmarks.py                     # Compare with it
+  python benchmarks/run_benchmarks.py --tolerance 0.3     # Allow 30% worse
+
+Baselines are machine-specific: record one on the machine that compares.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from types import SimpleNamespace
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+ROUTER_DIR = os.path.join(ROOT, "module1-canary-deployments")
+SERVER_DIR = os.path.join(ROOT, "module3-kubernetes-self-healing")
+sys.path[:0] = [ROUTER_DIR, SERVER_DIR]
+
+from metrics_core import LatencyHistogram  # noqa: E402  (needs the paths above)
+
+DEFAULT_BASELINE = os.path.join(HERE, "baseline.json")
+DEFAULT_RESULTS = os.path.join(HERE, "results.json")
+DEFAULT_TOLERANCE = 0.25  # A metric may be 25% worse than its baseline
+SEED = 1234
+
+# Registry stages served by the stand-in registry
+STUB_VERSIONS = {"Production": "1", "Staging": "2"}
+
+# Metrics where a larger value is better; everything else is a cost
+HIGHER_IS_BETTER = ("throughput_rps",)
+
+
+# ============================================================
+# OFFLINE MODEL REGISTRY
+# ============================================================
+def train_stub_model(version):
+    """Same pipeline shape as setup_models.create_model, trained locally."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
+
+    from send_requests import TEST_DATA
+
+    pipeline = Pipeline([
+        ('tfidf', TfidfVectorizer(max_features=100)),
+        ('clf', LogisticRegression(random_state=41 + int(version))),
+    ])
+    pipeline.fit([s["text"] for s in TEST_DATA], [s["actual_label"] for s in TEST_DATA])
+    return pipeline
+
+
+class StubPyfuncModel:
+    """Answers predict() like an mlflow.pyfunc model wrapping the pipeline."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def predict(self, data):
+        return self.pipeline.predict(list(data))
+
+
+class StubRegistryClient:
+    """Stands in for MlflowClient: fixed stage -> version mapping."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_latest_versions(self, name, stages=None):
+        return [SimpleNamespace(name=name, version=STUB_VERSIONS[stage], current_stage=stage)
+                for stage in (stages or STUB_VERSIONS) if stage in STUB_VERSIONS]
+
+
+def model_version_from_uri(uri):
+    return str(uri).rstrip("/").rsplit("/", 1)[-1]
+
+
+def offline_mlflow(stack):
+    """Patch the MLflow entry points app.py uses for the rest of the run."""
+    import mlflow.pyfunc
+    import mlflow.sklearn
+    import mlflow.tracking
+
+    pipelines = {v: train_stub_model(v) for v in STUB_VERSIONS.values()}
+    stack.enter_context(mock.patch.object(mlflow.tracking, "MlflowClient", StubRegistryClient))
+    stack.enter_context(mock.patch.object(
+        mlflow.pyfunc, "load_model",
+        lambda uri, **kwargs: StubPyfuncModel(pipelines[model_version_from_uri(uri)])))
+    stack.enter_context(mock.patch.object(
+        mlflow.sklearn, "load_model",
+        lambda uri, **kwargs: pipelines[model_version_from_uri(uri)]))
+
+
+def load_router(stack):
+    """Import app.py offline with background polling and logging turned off."""
+    os.environ.setdefault("MODEL_CACHE_ENABLED", "false")
+    os.environ.setdefault("MODEL_RELOAD_ENABLED", "false")
+    os.environ.setdefault("LOG_SAMPLE_RATE", "0")
+    offline_mlflow(stack)
+    import app
+    return app
+
+
+def load_model_server(stack):
+    """Import model_server.py with the simulated inference sleep removed."""
+    os.environ.setdefault("METRICS_CACHE_SECONDS", "0")  # Measure rendering, not the cache
+    import model_server
+    stack.enter_context(mock.patch.object(
+        model_server, "time", SimpleNamespace(**{**vars(time), "sleep": lambda seconds: None})))
+    return model_server
+
+
+# ============================================================
+# MEASUREMENT HELPERS
+# ============================================================
+def time_calls(fn, n, warmup=50):
+    """Call fn n times; return throughput and per-call p50/p99."""
+    for i in range(warmup):
+        fn(i)
+    histogram = LatencyHistogram()
+    start = time.perf_counter()
+    for i in range(n):
+        call_start = time.perf_counter()
+        fn(i)
+        histogram.record((time.perf_counter() - call_start) * 1000)
+    elapsed = time.perf_counter() - start
+    return {
+        "throughput_rps": round(n / elapsed, 1),
+        "p50_ms": round(histogram.percentile(50), 4),
+        "p99_ms": round(histogram.percentile(99), 4),
+    }
+
+
+def time_per_call_us(fn, n):
+    """Average cost of a very cheap call, timed in bulk (microseconds)."""
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return round((time.perf_counter() - start) / n * 1e6, 3)
+
+
+def median_of(runs):
+    """Median of each metric across repeated runs."""
+    return {key: round(statistics.median(run[key] for run in runs), 4) for key in runs[0]}
+
+
+def record_synthetic_predictions(app, n, threads=8):
+    """Grow router state: n predictions recorded from short-lived threads."""
+    def worker(count):
+        for i in range(count):
+            version = "canary" if i % 5 == 0 else "production"
+            app.record_prediction(version, 1, int(random.random() < 0.95), random.uniform(1, 40))
+
+    pool = [threading.Thread(target=worker, args=(n // threads,)) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+
+# ============================================================
+# BENCHMARKS
+# ============================================================
+def bench_router_predict(app, n):
+    client = app.app.test_client()
+    texts = [f"Great value for money, highly recommend #{i}" for i in range(n + 100)]
+    return time_calls(lambda i: client.post("/predict", json={"text": texts[i], "actual_label": 1}), n)
+
+
+def bench_router_metrics_scrape(app, n):
+    client = app.app.test_client()
+    result = {}
+    recorded = 0
+    for size in (1000, 10000, 100000):
+        record_synthetic_predictions(app, size - recorded)
+        recorded = size
+        timing = time_calls(lambda i: client.get("/metrics"), max(20, n // 20), warmup=5)
+        result[f"p50_ms_at_{size}"] = timing["p50_ms"]
+    return result
+
+
+def bench_router_routing(app, n):
+    router = app.router
+    keys = [f"user-{i}" for i in range(1000)]
+    return {
+        "keyed_route_us": time_per_call_us(lambda i: router.route(keys[i % 1000]), n * 50),
+        "random_route_us": time_per_call_us(lambda i: router.route(), n * 50),
+    }
+
+
+def bench_router_check_rollback(app, n):
+    client = app.app.test_client()
+    record_synthetic_predictions(app, 10000)
+    for i in range(2000):
+        app.rollback_evaluator.record("canary", random.random() < 0.95, random.uniform(1, 40))
+
+    timing = time_calls(lambda i: client.post("/check_rollback"), max(50, n // 10), warmup=5)
+    return {
+        "check_rollback_p50_ms": timing["p50_ms"],
+        "check_rollback_p99_ms": timing["p99_ms"],
+        "evaluate_us": time_per_call_us(lambda i: app.rollback_evaluator.evaluate(), max(100, n)),
+    }
+
+
+def bench_server_predict(model_server, n):
+    client = model_server.app.test_client()
+    return time_calls(lambda i: client.post("/predict", json={"features": [0.1, 0.2]}), n)
+
+
+def bench_server_metrics_scrape(model_server, n):
+    client = model_server.app.test_client()
+    result = {}
+    recorded = 0
+    for size in (1000, 10000, 100000):
+        for i in range(size - recorded):
+            latency_ms = random.uniform(20, 50)
+            model_server.metrics.record_request(latency_ms, success=i % 20 != 0)
+            model_server.metrics.record_endpoint_latency("/predict", latency_ms)
+        recorded = size
+        timing = time_calls(lambda i: client.get("/metrics"), max(20, n // 20), warmup=5)
+        result[f"p50_ms_at_{size}"] = timing["p50_ms"]
+    return result
+
+
+ROUTER_BENCHMARKS = [
+    ("router_predict", bench_router_predict),
+    ("router_metrics_scrape", bench_router_metrics_scrape),
+    ("router_routing", bench_router_routing),
+    ("router_check_rollback", bench_router_check_rollback),
+]
+SERVER_BENCHMARKS = [
+    ("server_predict", bench_server_predict),
+    ("server_metrics_scrape", bench_server_metrics_scrape),
+]
+
+
+def reset_router(app):
+    app.app.test_client().post("/reset")
+
+
+def reset_model_server(model_server):
+    model_server.metrics = model_server.Metrics()
+
+
+def run_all(n, repeat):
+    """Run every benchmark `repeat` times, each from a freshly reset state."""
+    results = {}
+    with ExitStack() as stack:
+        app = load_router(stack)
+        model_server = load_model_server(stack)
+        suites = [(app, reset_router, ROUTER_BENCHMARKS),
+                  (model_server, reset_model_server, SERVER_BENCHMARKS)]
+        for target, reset, benchmarks in suites:
+            for name, bench in benchmarks:
+                print(f"  {name}...", flush=True)
+                runs = []
+                for _ in range(repeat):
+                    reset(target)
+                    random.seed(SEED)
+                    runs.append(bench(target, n))
+                results[name] = median_of(runs)
+    return results
+
+
+# ============================================================
+# BASELINE COMPARISON
+# ============================================================
+def compare(results, baseline, tolerance):
+    """Return (rows, regressions) comparing results with the baseline."""
+    rows, regressions = [], []
+    for bench, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(bench, {}).get(metric)
+            if not old:
+                rows.append((bench, metric, None, value, None, "new"))
+                continue
+            higher_is_better = metric in HIGHER_IS_BETTER
+            change = (value - old) / old
+            worse = -change if higher_is_better else change
+            status = "REGRESSION" if worse > tolerance else "ok"
+            rows.append((bench, metric, old, value, change, status))
+            if status == "REGRESSION":
+                regressions.append(f"{bench}.{metric}: {old} -> {value} ({change:+.0%})")
+    return rows, regressions
+
+
+def print_rows(rows):
+    print(f"\n  {'Benchmark':24} {'Metric':24} {'Baseline':>10} {'Now':>10} {'Change':>8}  Status")
+    print("  " + "-" * 88)
+    for bench, metric, old, value, change, status in rows:
+        old_text = f"{old:>10}" if old is not None else f"{'-':>10}"
+        change_text = f"{change:>+8.0%}" if change is not None else f"{'-':>8}"
+        print(f"  {bench:24} {metric:24} {old_text} {value:>10} {change_text}  {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline router and model server benchmarks")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per /predict run")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark (median kept)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--output", default=DEFAULT_RESULTS)
+    parser.add_argument("--tolerance", type=float,
+                        default=float(os.environ.get("BENCH_TOLERANCE", DEFAULT_TOLERANCE)),
+                        help="allowed fraction worse than baseline (default 0.25)")
+    parser.add_argument("--update-baseline", action="store_true", help="write results as the new baseline")
+    args = parser.parse_args()
+
+    print("\n" + "=" * 60)
+    print(f"OFFLINE BENCHMARKS ({args.requests} requests, median of {args.repeat})")
+    print("=" * 60)
+    results = run_all(args.requests, args.repeat)
+    document = {
+        "python": sys.version.split()[0],
+        "requests": args.requests,
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+    path = args.baseline if args.update_baseline else args.output
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+    baseline = {}
+    if not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+
+    rows, regressions = compare(results, baseline, args.tolerance)
+    print_rows(rows)
+    print(f"\n  Results written to {path}")
+    if args.update_baseline:
+        print("  Baseline updated")
+        return 0
+    if not baseline:
+        print(f"  No baseline at {args.baseline} - run with --update-baseline to record one")
+        return 0
+    if regressions:
+        print(f"\n  {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+        for line in regressions:
+            print(f"    {line}")
+        return 1
+    print(f"\n  No regressions beyond {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
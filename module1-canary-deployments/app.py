@@ -10,106 +10,643 @@ Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
 Lab 1: Canary Deployments for ML Models
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
+import json
 import mlflow
+import mlflow.sklearn
+from mlflow.tracking import MlflowClient
+import os
 import random
+import re
+import threading
 import time
 from datetime import datetime
 
+from artifact_cache import ArtifactCache
+from batch_io import InvalidRecord, iter_chunks, iter_records
+from batching import MicroBatcher
+from fast_path import FastPathModel
+from log_sink import LogSink
+from metrics_core import LatencyHistogram, MetricsStore
+from model_watcher import ModelWatcher
+from prediction_cache import PredictionCache
+from rollback_evaluator import RollbackEvaluator
+from sampling_profiler import SamplingProfiler
+from shadow import ShadowScorer
+from stage_timing import (FAILURE_SIM, INFERENCE, LOG, METRICS, PARSE, QUEUE, ROUTE,
+                          SERIALIZE, StageTimer, StageTimings)
+from shared_state import SharedFlags, SharedMetricsStore, SharedWeightedRouter, worker_region
+from traffic_router import WeightedRouter
+
 app = Flask(__name__)
 
+# Set when this process is one of several workers started by serve.py:
+# metrics, routing weights and control flags then live in shared memory so
+# every worker sees and changes the same values.
+shared_region = worker_region()
+
 # ============================================================
 # MLFLOW MODEL LOADING
 # ============================================================
 mlflow.set_tracking_uri("http://127.0.0.1:5001")
 
+MODEL_NAME = "sentiment"
+MODEL_STAGES = {"production": "Production", "canary": "Staging"}
+
+# Besides the stage-tracking "production" and "canary" variants, any
+# registered version can be served as an extra variant named "v<version>"
+PINNED_VARIANT = re.compile(r"^v(\d+)$")
+
+# Start from locally cached artifacts (see artifact_cache.py) instead of
+# waiting on the tracking server, and optionally defer loading the canary
+# until the first request is routed to it.
+MODEL_CACHE_ENABLED = os.environ.get('MODEL_CACHE_ENABLED', 'true').lower() == 'true'
+CANARY_LAZY_LOAD = os.environ.get('CANARY_LAZY_LOAD', 'false').lower() == 'true'
+
+# "pyfunc" serves through mlflow.pyfunc; "sklearn" uses the native fast path
+# (fast_path.py) and times both paths on FAST_PATH_COMPARE_RATE of calls.
+SERVING_MODE = os.environ.get('SERVING_MODE', 'pyfunc').lower()
+FAST_PATH_COMPARE_RATE = float(os.environ.get('FAST_PATH_COMPARE_RATE', '0.05'))
+
+artifact_cache = ArtifactCache()
+
+# variant -> (loaded model, registry version it was loaded from).
+# Replaced as a whole tuple so a request never pairs one model with
+# another model's version number.
+serving_models = {}
+startup_info = {"models": {}}
+_lazy_load_lock = threading.Lock()
+
+
+def resolve_registry_version(stage):
+    """Look up which registered version currently holds a stage."""
+    client = MlflowClient()
+    versions = client.get_latest_versions(MODEL_NAME, stages=[stage])
+    if not versions:
+        raise RuntimeError(f"No '{MODEL_NAME}' version is in stage {stage}")
+    version = versions[0].version
+    if MODEL_CACHE_ENABLED:
+        artifact_cache.record_stage(MODEL_NAME, stage, version)
+    return version
+
+
+def load_registry_model(registry_version):
+    """Load one registered version of the model (through the local cache if enabled)."""
+    if MODEL_CACHE_ENABLED:
+        model_uri = artifact_cache.fetch(MODEL_NAME, registry_version)
+    else:
+        model_uri = f"models:/{MODEL_NAME}/{registry_version}"
+    model = mlflow.pyfunc.load_model(model_uri)
+
+    if SERVING_MODE == "sklearn":
+        try:
+            return FastPathModel(mlflow.sklearn.load_model(model_uri), model, FAST_PATH_COMPARE_RATE)
+        except ValueError as e:
+            # Equivalence check failed or unsupported pipeline - stay on pyfunc
+            print(f"Fast path disabled for version {registry_version}: {e}")
+    return model
+
+
+def is_valid_variant(model_version):
+    return model_version in MODEL_STAGES or PINNED_VARIANT.match(model_version) is not None
+
+
+def load_initial_model(model_version):
+    """
+    Load the first model for a variant. Stage variants prefer the version
+    cached for their stage (the hot-reload watcher later verifies it against
+    the registry); "v<N>" variants always load registry version N.
+    """
+    start = time.perf_counter()
+
+    if model_version in MODEL_STAGES:
+        stage = MODEL_STAGES[model_version]
+        registry_version = artifact_cache.stage_version(MODEL_NAME, stage) if MODEL_CACHE_ENABLED else None
+        if registry_version is not None and artifact_cache.local_path(MODEL_NAME, registry_version):
+            source = "cache"
+        else:
+            registry_version = resolve_registry_version(stage)
+            source = "registry"
+    else:
+        pinned = PINNED_VARIANT.match(model_version)
+        if pinned is None:
+            raise ValueError(f"Unknown model variant '{model_version}'")
+        registry_version = pinned.group(1)
+        cached = MODEL_CACHE_ENABLED and artifact_cache.local_path(MODEL_NAME, registry_version)
+        source = "cache" if cached else "registry"
+
+    install_model(model_version, load_registry_model(registry_version), registry_version)
+    startup_info["models"][model_version] = {
+        "version": str(registry_version),
+        "source": source,
+        "load_ms": round((time.perf_counter() - start) * 1000, 1)
+    }
+
+
+def get_serving_model(model_version):
+    """Return (model, registry version) for a variant, lazy-loading it if needed."""
+    serving = serving_models.get(model_version)
+    if serving is None:
+        with _lazy_load_lock:
+            if model_version not in serving_models:
+                load_initial_model(model_version)
+        serving = serving_models[model_version]
+    return serving
+
+
+def install_model(model_version, model, registry_version):
+    """Start serving a model for 'production' or 'canary'."""
+    previous = serving_models.get(model_version)
+    serving_models[model_version] = (model, str(registry_version))
+    if previous is None or previous[1] == str(registry_version):
+        return
+
+    # A new version starts with fresh metrics so rollback judges it alone.
+    # Under serve.py every worker reloads it; only the first call resets.
+    metrics.reset_series(model_version, registry_version)
+    rollback_evaluator.reset_variant(model_version)
+
+    # Cached predictions of a version nobody serves anymore are useless
+    if previous[1] not in {v for _, v in serving_models.values()}:
+        prediction_cache.invalidate_model(MODEL_NAME, previous[1])
+
+
 print("Loading models from MLflow...")
-production_model = mlflow.pyfunc.load_model("models:/sentiment/Production")
-canary_model = mlflow.pyfunc.load_model("models:/sentiment/Staging")
-print("Models loaded successfully!")
+_startup_start = time.perf_counter()
+for model_version in MODEL_STAGES:
+    if model_version == "canary" and CANARY_LAZY_LOAD:
+        continue
+    load_initial_model(model_version)
+
+# "warm" = every model came from the local cache, "cold" = registry was needed
+startup_info["kind"] = "warm" if all(
+    m["source"] == "cache" for m in startup_info["models"].values()) else "cold"
+startup_info["total_ms"] = round((time.perf_counter() - _startup_start) * 1000, 1)
+if MODEL_CACHE_ENABLED:
+    artifact_cache.record_startup(startup_info["kind"], startup_info["total_ms"])
+print(f"Models loaded successfully! ({startup_info['kind']} start, {startup_info['total_ms']:.0f}ms)")
 
 # ============================================================
 # CANARY CONFIGURATION
 # ============================================================
-CANARY_PERCENTAGE = 20  # Percentage of traffic routed to canary model
+CANARY_PERCENTAGE = 20  # Initial percentage of traffic routed to canary model
+
+# Weighted, sticky routing across any number of variants. Requests with the
+# same routing key (user_id field or X-User-Id header) always hit the same
+# variant; /set_canary and /set_weights swap the weights atomically.
+INITIAL_WEIGHTS = {"production": 100 - CANARY_PERCENTAGE, "canary": CANARY_PERCENTAGE}
+if shared_region is not None:
+    router = SharedWeightedRouter(shared_region, INITIAL_WEIGHTS)
+else:
+    router = WeightedRouter(INITIAL_WEIGHTS)
+
+
+def variant_percentage(model_version):
+    """Current traffic percentage of one variant."""
+    weights = router.weights()
+    total = sum(weights.values())
+    percentage = weights.get(model_version, 0) * 100 / total if total else 0
+    return int(percentage) if percentage == int(percentage) else round(percentage, 1)
+
+
+def canary_percentage():
+    return variant_percentage("canary")
 
 # Rollback thresholds - trigger rollback if canary performance drops below these
 ACCURACY_THRESHOLD = 85  # Minimum accuracy percentage
 LATENCY_THRESHOLD = 100  # Maximum P95 latency in milliseconds
 
+# ============================================================
+# MICRO-BATCHING (optional)
+# ============================================================
+# When enabled, concurrent requests for the same model version are scored
+# together in one vectorized predict() call.
+BATCHING_ENABLED = os.environ.get('BATCHING_ENABLED', 'false').lower() == 'true'
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '32'))        # Max requests per batch
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', '5'))  # Max time a request waits for a batch
+
+batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(model_version):
+    """Return the micro-batcher for a variant, creating it on first use."""
+    batcher = batchers.get(model_version)
+    if batcher is None:
+        with _batchers_lock:
+            if model_version not in batchers:
+                batchers[model_version] = MicroBatcher(
+                    lambda texts: get_serving_model(model_version)[0].predict(texts),
+                    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, name=model_version)
+            batcher = batchers[model_version]
+    return batcher
+
+# ============================================================
+# PREDICTION CACHE
+# ============================================================
+# Repeated texts are answered from an in-process LRU cache keyed on
+# (model name, registry version, normalized text).
+CACHE_ENABLED = os.environ.get('CACHE_ENABLED', 'true').lower() == 'true'
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', '300'))
+
+prediction_cache = PredictionCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+
+# ============================================================
+# REQUEST LOGGING
+# ============================================================
+# Per-request lines go through a sampled, bounded log sink drained by a
+# background thread (see log_sink.py), so a slow terminal or log collector
+# never blocks /predict. Rollback banners bypass sampling and the buffer.
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1.0'))  # Fraction of requests logged
+LOG_BUFFER_SIZE = int(os.environ.get('LOG_BUFFER_SIZE', '10000'))  # Records held before dropping
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()          # "text" or "json"
+
+
+def format_prediction(fields):
+    """Terminal line for one prediction."""
+    icon = "[PROD]  " if fields["variant"] == "production" else f"[{fields['variant'].upper()}]"
+    return f"{icon} Prediction: {fields['prediction']} | Latency: {fields['latency_ms']:.1f}ms"
+
+
+log_sink = LogSink(LOG_SAMPLE_RATE, LOG_BUFFER_SIZE, LOG_FORMAT,
+                   formatters={"prediction": format_prediction})
+
+# ============================================================
+# STAGE TIMING AND PROFILING
+# ============================================================
+# Every /predict is split into stages (parse, route, inference, failure
+# simulation, metrics, logging, serialization) with per-version histograms
+# at /timings. /profile samples the hot-path stacks on demand.
+STAGE_TIMING_ENABLED = os.environ.get('STAGE_TIMING_ENABLED', 'true').lower() == 'true'
+
+stage_timings = StageTimings()
+profiler = SamplingProfiler()
+
 # ============================================================
 # METRICS TRACKING
 # ============================================================
-metrics = {
-    "production": {"requests": 0, "correct": 0, "latencies": []},
-    "canary": {"requests": 0, "correct": 0, "latencies": []}
+# One series per variant. Request threads write to their own shard without
+# locking; readers merge the shards (see metrics_core.py). Under serve.py
+# every worker writes its own rows of a shared-memory region instead.
+metrics = SharedMetricsStore(shared_region) if shared_region is not None else MetricsStore()
+
+
+def variant_metrics():
+    """Merged {"requests", "correct", "latency"} for every variant."""
+    result = {version: {"requests": 0, "correct": 0, "latency": LatencyHistogram()}
+              for version in ("production", "canary")}
+    for version, series in metrics.snapshot().items():
+        result[version] = {
+            "requests": series["counters"].get("requests", 0),
+            "correct": series["counters"].get("correct", 0),
+            "latency": series["latency"],
+        }
+    return result
+
+# Switched at runtime by /simulate_failure and /shadow (shared by all workers)
+FLAG_DEFAULTS = {
+    "simulate_failure": False,  # For demonstration: simulate canary failure
+    "shadow_mode": os.environ.get('SHADOW_MODE', 'false').lower() == 'true',
 }
+flags = SharedFlags(shared_region, FLAG_DEFAULTS) if shared_region is not None else dict(FLAG_DEFAULTS)
+
+
+def simulate_failure(model_version, prediction):
+    """Flip ~40% of canary (non-production) predictions when failure simulation is on."""
+    if flags["simulate_failure"] and model_version != "production":
+        if random.random() > 0.6:  # 40% wrong predictions
+            return 1 - prediction
+    return prediction
+
 
-# For demonstration: simulate canary failure
-SIMULATE_CANARY_FAILURE = False
+def record_prediction(model_version, prediction, actual_label, latency_ms):
+    """Update request, accuracy and latency metrics for one prediction."""
+    correct = (prediction == actual_label) if actual_label is not None else None
+    metrics.record(model_version, latency_ms, requests=1, correct=int(bool(correct)),
+                   labeled=int(correct is not None))
+
+    # Under serve.py the evaluator reads the shared metrics instead
+    if AUTO_ROLLBACK_ENABLED and shared_region is None and model_version != "production":
+        rollback_evaluator.record(model_version, correct, latency_ms)
+
+
+# ============================================================
+# SHADOW MODE
+# ============================================================
+# Production answers every request; the canary scores a copy on a bounded
+# background pool and records results under the "shadow" variant, so it can
+# be judged at full traffic volume with zero added user latency.
+SHADOW_WORKERS = int(os.environ.get('SHADOW_WORKERS', '2'))
+SHADOW_QUEUE_SIZE = int(os.environ.get('SHADOW_QUEUE_SIZE', '1000'))
+
+
+def score_shadow(text, actual_label):
+    """Runs on a shadow worker: canary prediction recorded as "shadow"."""
+    model, registry_version = get_serving_model("canary")
+    start_time = time.time()
+    try:
+        prediction = predict_one("canary", model, registry_version, text)
+    except Exception:
+        prediction = -1
+    latency_ms = (time.time() - start_time) * 1000
+    record_prediction("shadow", prediction, actual_label, latency_ms)
+
+
+shadow_scorer = ShadowScorer(score_shadow, SHADOW_WORKERS, SHADOW_QUEUE_SIZE)
+
+
+# ============================================================
+# AUTOMATIC ROLLBACK (optional)
+# ============================================================
+# A background evaluator runs sequential tests on sliding windows of canary
+# traffic and rolls back as soon as the evidence is significant, without
+# anyone polling /check_rollback. See rollback_evaluator.py.
+#
+# Under serve.py a single evaluator in worker 0 judges the traffic of all
+# workers: before each evaluation it turns what the shared metrics gained
+# since the last one into batch observations.
+AUTO_ROLLBACK_ENABLED = os.environ.get('AUTO_ROLLBACK_ENABLED', 'false').lower() == 'true'
+EVALUATOR_WORKER = 0
+
+
+def trigger_rollback(model_version, reason, message):
+    """Take a failing canary out of service and print the rollback banner."""
+    banner = ["", "=" * 60, message]
+    if model_version == "shadow":
+        flags["shadow_mode"] = False
+        banner.append("Shadow mode stopped - canary no longer scores mirrored traffic")
+    else:
+        old_percentage = variant_percentage(model_version)
+        router.set_percentage(model_version, 0)
+        banner.append(f"{model_version} traffic: {old_percentage}% -> 0%")
+        banner.append("Its traffic is now routed to Production")
+    banner += ["=" * 60, ""]
+    log_sink.always("\n".join(banner))  # Never sampled or dropped
+
+
+_feed_state = {"generation": None, "series": {}}
+
+
+def feed_shared_observations():
+    """Evaluator feed under serve.py: new canary traffic of every worker."""
+    if _feed_state["generation"] != metrics.generation:
+        # /reset was called on some worker
+        _feed_state["generation"] = metrics.generation
+        _feed_state["series"] = {}
+        rollback_evaluator.reset()
+    if flags["simulate_failure"]:
+        rollback_evaluator.failure_started_at = flags.switched_on_at("simulate_failure")
+
+    for model_version, series in metrics.snapshot().items():
+        if model_version == "production":
+            continue
+        counters, latency = series["counters"], series["latency"]
+        previous = _feed_state["series"].get(model_version)
+        _feed_state["series"][model_version] = (counters, latency)
+        delta = LatencyHistogram()
+        if previous is None or counters.get("requests", 0) < previous[0].get("requests", 0) \
+                or any(now < before for now, before in zip(latency.counts, previous[1].counts)):
+            # First look, or the series was reset (hot reload): all of it is new
+            previous = ({}, delta)
+        requests = counters.get("requests", 0) - previous[0].get("requests", 0)
+        if requests <= 0:
+            continue
+        delta.counts = [now - before for now, before in zip(latency.counts, previous[1].counts)]
+        delta.count = latency.count - previous[1].count
+        delta.total_ms = latency.total_ms - previous[1].total_ms
+        delta.max_seen_ms = latency.max_seen_ms
+        rollback_evaluator.record_counts(
+            model_version, requests,
+            counters.get("labeled", 0) - previous[0].get("labeled", 0),
+            counters.get("correct", 0) - previous[0].get("correct", 0),
+            delta)
+
+
+rollback_evaluator = RollbackEvaluator(
+    on_rollback=trigger_rollback,
+    accuracy_threshold=ACCURACY_THRESHOLD,
+    latency_threshold=LATENCY_THRESHOLD,
+    accuracy_margin=float(os.environ.get('AUTO_ROLLBACK_ACCURACY_MARGIN', '5')),
+    alpha=float(os.environ.get('AUTO_ROLLBACK_ALPHA', '0.01')),
+    beta=float(os.environ.get('AUTO_ROLLBACK_BETA', '0.05')),
+    window_seconds=float(os.environ.get('AUTO_ROLLBACK_WINDOW_SECONDS', '60')),
+    interval_seconds=float(os.environ.get('AUTO_ROLLBACK_INTERVAL_SECONDS', '1')),
+    feed=feed_shared_observations if shared_region is not None else None
+)
+if AUTO_ROLLBACK_ENABLED and (shared_region is None or shared_region.worker_index == EVALUATOR_WORKER):
+    rollback_evaluator.start()
+
+
+# ============================================================
+# HOT RELOAD
+# ============================================================
+# Poll the registry and swap in new Production/Staging versions without
+# restarting the router.
+MODEL_RELOAD_ENABLED = os.environ.get('MODEL_RELOAD_ENABLED', 'true').lower() == 'true'
+MODEL_RELOAD_INTERVAL_SECONDS = float(os.environ.get('MODEL_RELOAD_INTERVAL_SECONDS', '30'))
+
+model_watcher = ModelWatcher(
+    stages=MODEL_STAGES,
+    resolve_version=resolve_registry_version,
+    load_model=load_registry_model,
+    install_model=install_model,
+    current_version=lambda model_version: serving_models.get(model_version, (None, None))[1],
+    interval_seconds=MODEL_RELOAD_INTERVAL_SECONDS
+)
+if MODEL_RELOAD_ENABLED:
+    # Check right away so a start from stale cached artifacts is corrected quickly
+    model_watcher.start(check_now=True)
 
 
 # ============================================================
 # CORE ROUTING LOGIC
 # ============================================================
+def predict_one(model_version, model, registry_version, text, timer=None):
+    """
+    Score one text: from the cache, or batched with concurrent requests if
+    enabled, or with a direct predict() call. Cache hits still go through
+    failure simulation so accuracy tracking sees the same outcomes.
+    """
+    cache_key = PredictionCache.make_key(MODEL_NAME, registry_version, text)
+    prediction = prediction_cache.get(cache_key) if CACHE_ENABLED else None
+
+    if prediction is None:
+        if BATCHING_ENABLED:
+            prediction = get_batcher(model_version).predict(text)
+        else:
+            prediction = model.predict([text])[0]
+        if CACHE_ENABLED:
+            prediction_cache.put(cache_key, prediction)
+
+    if timer:
+        timer.mark(INFERENCE)
+    return simulate_failure(model_version, prediction)
+
+
 @app.route('/predict', methods=['POST'])
 def predict():
     """
     Main prediction endpoint with canary routing.
 
-    The routing decision is simple:
-    - Generate a random number between 0-100
-    - If less than CANARY_PERCENTAGE, route to canary
-    - Otherwise, route to production
+    The routing decision:
+    - Each variant (production, canary, ...) owns a share of traffic
+      proportional to its weight
+    - Requests with a routing key (user_id / X-User-Id) always go to the
+      same variant; requests without one are routed randomly
     """
-    global CANARY_PERCENTAGE
-
+    timer = StageTimer() if STAGE_TIMING_ENABLED else None
     data = request.json
     text = data.get('text', '')
     actual_label = data.get('actual_label')  # For accuracy tracking
+    routing_key = data.get('user_id', request.headers.get('X-User-Id'))
+    if timer:
+        timer.mark(PARSE)
+
+    result = handle_prediction(text, actual_label, routing_key, timer)
+    response = jsonify(result)
+    if timer:
+        timer.mark(SERIALIZE)
+        stage_timings.record(result['model_version'], timer)
+    return response
 
+
+def handle_prediction(text, actual_label=None, routing_key=None, timer=None):
+    """
+    Route, score, record and log one request. Shared by the Flask /predict
+    endpoint and the async server (asgi_app.py). Returns the response body.
+    Stages are charged to `timer` (a StageTimer) when one is given.
+    """
+    if timer:
+        timer.mark(QUEUE)
     start_time = time.time()
 
-    # CANARY ROUTING DECISION
-    if random.random() * 100 < CANARY_PERCENTAGE:
-        model_version = "canary"
-        model = canary_model
-    else:
-        model_version = "production"
-        model = production_model
+    # CANARY ROUTING DECISION (shadow mode: production always answers)
+    model_version = "production" if flags["shadow_mode"] else router.route(routing_key)
+    model, registry_version = get_serving_model(model_version)
+    if timer:
+        timer.mark(ROUTE)
 
     # Make prediction
     try:
-        prediction = model.predict([text])[0]
-
-        # Simulate failure for demonstration
-        if SIMULATE_CANARY_FAILURE and model_version == "canary":
-            if random.random() > 0.6:  # 40% wrong predictions
-                prediction = 1 - prediction
-
+        prediction = predict_one(model_version, model, registry_version, text, timer)
     except Exception as e:
         prediction = -1
+    if timer:
+        timer.mark(FAILURE_SIM)
 
     # Calculate latency
     latency_ms = (time.time() - start_time) * 1000
 
     # Track metrics
-    metrics[model_version]["requests"] += 1
-    metrics[model_version]["latencies"].append(latency_ms)
+    record_prediction(model_version, prediction, actual_label, latency_ms)
 
-    if actual_label is not None:
-        if prediction == actual_label:
-            metrics[model_version]["correct"] += 1
+    # Shadow mode: the canary scores a copy in the background
+    if flags["shadow_mode"]:
+        shadow_scorer.submit(text, actual_label)
+    if timer:
+        timer.mark(METRICS)
 
-    # Log for terminal visibility
-    icon = "[CANARY]" if model_version == "canary" else "[PROD]  "
-    print(f"{icon} Prediction: {prediction} | Latency: {latency_ms:.1f}ms")
+    # Log for terminal visibility (sampled, written by a background thread)
+    log_sink.log("prediction", variant=model_version, prediction=int(prediction),
+                 latency_ms=round(latency_ms, 2))
+    if timer:
+        timer.mark(LOG)
 
-    return jsonify({
+    return {
         'prediction': int(prediction),
         'model_version': model_version,
         'latency_ms': round(latency_ms, 2)
-    })
+    }
+
+
+# ============================================================
+# BATCH PREDICTION ENDPOINT
+# ============================================================
+PREDICT_BATCH_CHUNK_SIZE = int(os.environ.get('PREDICT_BATCH_CHUNK_SIZE', '256'))
+
+
+def score_chunk(chunk, first_index):
+    """
+    Route every row of a chunk, then score each model version's rows with
+    one vectorized predict() call. Returns result dicts in input order.
+
+    Latency recorded per row is the version's predict() time divided by the
+    number of rows it scored (amortized cost per prediction).
+    """
+    results = [None] * len(chunk)
+    rows_by_version = {}
+
+    for offset, record in enumerate(chunk):
+        index = first_index + offset
+        if isinstance(record, InvalidRecord):
+            results[offset] = {"index": index, "error": record.error}
+        elif not isinstance(record, dict):
+            results[offset] = {"index": index, "error": "each item must be a JSON object"}
+        else:
+            # Same routing decision as /predict, made per row
+            if flags["shadow_mode"]:
+                model_version = "production"
+                shadow_scorer.submit(record.get('text', ''), record.get('actual_label'))
+            else:
+                model_version = router.route(record.get('user_id'))
+            rows_by_version.setdefault(model_version, []).append(offset)
+
+    for model_version, offsets in rows_by_version.items():
+        model, registry_version = get_serving_model(model_version)
+        texts = [chunk[o].get('text', '') for o in offsets]
+        start_time = time.time()
+
+        # Only rows missing from the cache go through the model
+        cache_keys = [PredictionCache.make_key(MODEL_NAME, registry_version, t) for t in texts]
+        predictions = [prediction_cache.get(k) if CACHE_ENABLED else None for k in cache_keys]
+        missing = [i for i, p in enumerate(predictions) if p is None]
+        if missing:
+            try:
+                scored = model.predict([texts[i] for i in missing])
+                for i, prediction in zip(missing, scored):
+                    predictions[i] = prediction
+                    if CACHE_ENABLED:
+                        prediction_cache.put(cache_keys[i], prediction)
+            except Exception:
+                for i in missing:
+                    predictions[i] = -1
+        latency_ms = (time.time() - start_time) * 1000 / len(texts)
+
+        for offset, prediction in zip(offsets, predictions):
+            if prediction != -1:
+                prediction = simulate_failure(model_version, prediction)
+            record_prediction(model_version, prediction, chunk[offset].get('actual_label'), latency_ms)
+            results[offset] = {
+                'index': first_index + offset,
+                'prediction': int(prediction),
+                'model_version': model_version,
+                'latency_ms': round(latency_ms, 3)
+            }
+
+    return results
+
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """
+    Bulk prediction endpoint for offline re-scoring jobs.
+
+    Accepts a JSON array or JSONL body of {"text": ..., "actual_label": ...}
+    objects and streams one JSON result per line back. Input is read and
+    scored in chunks of PREDICT_BATCH_CHUNK_SIZE rows, so memory stays flat
+    regardless of payload size. Metrics are updated exactly like /predict.
+    """
+    stream = request.stream
+
+    def generate():
+        index = 0
+        for chunk in iter_chunks(iter_records(stream), PREDICT_BATCH_CHUNK_SIZE):
+            lines = [json.dumps(result) for result in score_chunk(chunk, index)]
+            index += len(chunk)
+            yield "\n".join(lines) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 # ============================================================
@@ -117,27 +654,77 @@ def predict():
 # ============================================================
 @app.route('/metrics', methods=['GET'])
 def get_metrics():
-    """Return current metrics for both model versions."""
+    """Return current metrics for every model variant."""
     result = {}
 
-    for version in ["production", "canary"]:
-        m = metrics[version]
+    for version, m in variant_metrics().items():
         total = m["requests"]
         correct = m["correct"]
 
         accuracy = (correct / total * 100) if total > 0 else 0
-        avg_latency = sum(m["latencies"]) / len(m["latencies"]) if m["latencies"] else 0
 
         result[version] = {
             "requests": total,
             "accuracy": round(accuracy, 1),
-            "avg_latency_ms": round(avg_latency, 1)
+            **m["latency"].summary()
         }
 
-    result["canary_percentage"] = CANARY_PERCENTAGE
+    result["canary_percentage"] = canary_percentage()
+    result["weights"] = router.weights()
+    result["model_versions"] = {version: v for version, (_, v) in serving_models.items()}
+    if shared_region is not None:
+        # Everything above is summed over all workers; the sections below
+        # (cache, fast path, startup, reload, batching...) are this worker's
+        result["workers"] = {"count": shared_region.workers, "worker": shared_region.worker_index,
+                             "pid": os.getpid()}
+    result["cache"] = {"enabled": CACHE_ENABLED, **prediction_cache.stats()}
+    result["fast_path"] = {
+        "serving_mode": SERVING_MODE,
+        **{version: model.stats() for version, (model, _) in serving_models.items()
+           if isinstance(model, FastPathModel)}
+    }
+    result["startup"] = {**startup_info, "previous": artifact_cache.startup_times()}
+    result["hot_reload"] = {"enabled": MODEL_RELOAD_ENABLED, **model_watcher.stats()}
+    result["auto_rollback"] = {"enabled": AUTO_ROLLBACK_ENABLED, **rollback_evaluator.stats()}
+    if shared_region is not None:
+        result["auto_rollback"]["evaluator_worker"] = EVALUATOR_WORKER  # Only its stats are live
+    result["logging"] = log_sink.stats()
+    result["shadow_mode"] = {"enabled": flags["shadow_mode"], **shadow_scorer.stats()}
+    result["batching"] = {
+        "enabled": BATCHING_ENABLED,
+        "max_batch_size": BATCH_MAX_SIZE,
+        "max_wait_ms": BATCH_MAX_WAIT_MS,
+        **{version: b.stats() for version, b in batchers.items()}
+    }
     return jsonify(result)
 
 
+@app.route('/timings', methods=['GET'])
+def get_timings():
+    """Per-stage latency of /predict for every model variant."""
+    return jsonify({"enabled": STAGE_TIMING_ENABLED, "variants": stage_timings.summary()})
+
+
+@app.route('/profile', methods=['GET'])
+def get_profile():
+    """
+    Sample hot-path stacks for ?seconds=N (default 5) and return the
+    busiest frames. ?interval_ms= sets the sampling interval, ?idle=1 keeps
+    idle threads and ?format=collapsed returns flame-graph input as text.
+    """
+    try:
+        report = profiler.profile(request.args.get('seconds', 5, type=float),
+                                  request.args.get('interval_ms', 5, type=float),
+                                  include_idle=request.args.get('idle') == '1')
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+
+    if request.args.get('format') == 'collapsed':
+        return Response("\n".join(report["collapsed"]) + "\n", mimetype="text/plain")
+    del report["collapsed"]
+    return jsonify(report)
+
+
 # ============================================================
 # ROLLBACK CHECK - AUTOMATIC PROTECTION
 # ============================================================
@@ -146,42 +733,66 @@ def check_rollback():
     """
     Check if canary metrics warrant a rollback.
 
+    Every non-production variant (including "shadow") is checked.
     Rollback is triggered when:
     - Canary accuracy drops below ACCURACY_THRESHOLD
-    - (Optional) Canary latency exceeds LATENCY_THRESHOLD
+    - Canary P95 latency exceeds LATENCY_THRESHOLD
+    A rolled-back variant's weight drops to 0 and production takes its
+    traffic; a failing shadow canary ends shadow mode.
     """
-    global CANARY_PERCENTAGE
-
-    canary_metrics = metrics["canary"]
-
-    if canary_metrics["requests"] < 5:
-        return jsonify({"status": "waiting", "message": "Not enough data yet"})
+    checked = {}
+    rolled_back = []
+
+    for model_version, m in variant_metrics().items():
+        if model_version == "production":
+            continue
+        if m["requests"] < 5:
+            continue
+
+        accuracy = (m["correct"] / m["requests"]) * 100
+        p95_latency = m["latency"].percentile(95)
+        checked[model_version] = {
+            "canary_accuracy": round(accuracy, 1),
+            "canary_p95_latency_ms": round(p95_latency, 1)
+        }
 
-    accuracy = (canary_metrics["correct"] / canary_metrics["requests"]) * 100
+        if accuracy < ACCURACY_THRESHOLD:
+            reason = "accuracy_below_threshold"
+            message = f"ROLLBACK TRIGGERED! {model_version} accuracy {accuracy:.1f}% < {ACCURACY_THRESHOLD}% threshold"
+            threshold = ACCURACY_THRESHOLD
+        elif p95_latency > LATENCY_THRESHOLD:
+            reason = "latency_above_threshold"
+            message = f"ROLLBACK TRIGGERED! {model_version} P95 latency {p95_latency:.1f}ms > {LATENCY_THRESHOLD}ms threshold"
+            threshold = LATENCY_THRESHOLD
+        else:
+            continue
 
-    if accuracy < ACCURACY_THRESHOLD:
         # TRIGGER ROLLBACK
-        old_percentage = CANARY_PERCENTAGE
-        CANARY_PERCENTAGE = 0
+        trigger_rollback(model_version, reason, message)
 
-        message = f"ROLLBACK TRIGGERED! Canary accuracy {accuracy:.1f}% < {ACCURACY_THRESHOLD}% threshold"
-        print("\n" + "=" * 60)
-        print(message)
-        print(f"Canary traffic: {old_percentage}% -> 0%")
-        print("All traffic now routed to Production")
-        print("=" * 60 + "\n")
+        rolled_back.append({
+            "variant": model_version,
+            "reason": reason,
+            **checked[model_version],
+            "threshold": threshold
+        })
 
+    if rolled_back:
         return jsonify({
             "status": "rollback",
-            "reason": "accuracy_below_threshold",
-            "canary_accuracy": round(accuracy, 1),
-            "threshold": ACCURACY_THRESHOLD
+            **rolled_back[0],
+            "rolled_back": [r["variant"] for r in rolled_back]
         })
 
-    return jsonify({
-        "status": "healthy",
-        "canary_accuracy": round(accuracy, 1)
-    })
+    if not checked:
+        return jsonify({"status": "waiting", "message": "Not enough data yet"})
+
+    if AUTO_ROLLBACK_ENABLED:
+        for model_version in checked:
+            checked[model_version]["sequential"] = rollback_evaluator.status(model_version)
+
+    primary = checked.get("canary") or next(iter(checked.values()))
+    return jsonify({"status": "healthy", **primary, "variants": checked})
 
 
 # ============================================================
@@ -189,35 +800,79 @@ def check_rollback():
 # ============================================================
 @app.route('/set_canary/<int:percentage>', methods=['POST'])
 def set_canary_percentage(percentage):
-    """Adjust the canary traffic percentage (0-100)."""
-    global CANARY_PERCENTAGE
-    old = CANARY_PERCENTAGE
-    CANARY_PERCENTAGE = min(100, max(0, percentage))
-    print(f"\nCanary percentage changed: {old}% -> {CANARY_PERCENTAGE}%\n")
-    return jsonify({"canary_percentage": CANARY_PERCENTAGE})
+    """
+    Adjust the canary traffic percentage (0-100) of the current total
+    weight; other extra variants keep theirs if they fit and production
+    gets the rest.
+    """
+    old = canary_percentage()
+    router.set_percentage("canary", percentage)
+    print(f"\nCanary percentage changed: {old}% -> {canary_percentage()}%\n")
+    return jsonify({"canary_percentage": canary_percentage(), "weights": router.weights()})
+
+
+@app.route('/set_weights', methods=['POST'])
+def set_weights():
+    """
+    Replace all routing weights at once, e.g.
+    {"production": 70, "canary": 20, "v3": 10}
+
+    "v<N>" variants serve registry version N and are loaded before the new
+    weights take effect, so no request waits on a model load.
+    """
+    weights = request.get_json(silent=True)
+    if not isinstance(weights, dict):
+        return jsonify({"error": "Body must be a JSON object of variant weights"}), 400
+    try:
+        for model_version, weight in weights.items():
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)):
+                raise ValueError(f"Weight for {model_version} must be a number")
+            if not is_valid_variant(model_version):
+                raise ValueError(f"Unknown variant '{model_version}' (use production, canary or v<N>)")
+            if int(weight) > 0:
+                get_serving_model(model_version)
+        weights = router.set_weights(weights)
+    except (ValueError, TypeError, RuntimeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    print(f"\nRouting weights changed: {weights}\n")
+    return jsonify({"weights": weights, "canary_percentage": canary_percentage()})
 
 
 @app.route('/simulate_failure/<int:enable>', methods=['POST'])
 def toggle_failure(enable):
     """Toggle canary failure simulation (for demonstration)."""
-    global SIMULATE_CANARY_FAILURE
-    SIMULATE_CANARY_FAILURE = bool(enable)
+    if enable and not flags["simulate_failure"]:
+        rollback_evaluator.mark_failure_started()  # Starts the time-to-detect clock
+    flags["simulate_failure"] = bool(enable)
     status = "ENABLED" if enable else "DISABLED"
     print(f"\nFailure simulation: {status}\n")
-    return jsonify({"simulate_failure": SIMULATE_CANARY_FAILURE})
+    return jsonify({"simulate_failure": flags["simulate_failure"]})
+
+
+@app.route('/shadow/<int:enable>', methods=['POST'])
+def toggle_shadow(enable):
+    """Toggle shadow mode: production answers, canary scores copies in the background."""
+    flags["shadow_mode"] = bool(enable)
+    status = "ENABLED" if enable else "DISABLED"
+    print(f"\nShadow mode: {status}\n")
+    return jsonify({"shadow_mode": flags["shadow_mode"]})
 
 
 @app.route('/reset', methods=['POST'])
 def reset_metrics():
     """Reset all metrics and settings to initial state."""
-    global metrics, CANARY_PERCENTAGE, SIMULATE_CANARY_FAILURE
-    metrics = {
-        "production": {"requests": 0, "correct": 0, "latencies": []},
-        "canary": {"requests": 0, "correct": 0, "latencies": []}
-    }
-    CANARY_PERCENTAGE = 20
-    SIMULATE_CANARY_FAILURE = False
-    print("\nMetrics and settings reset (canary at 20%)\n")
+    metrics.reset()
+    for b in batchers.values():
+        b.reset_stats()
+    prediction_cache.reset_stats()
+    shadow_scorer.reset_stats()
+    log_sink.reset_stats()
+    stage_timings.reset()
+    rollback_evaluator.reset()
+    router.set_weights(INITIAL_WEIGHTS)
+    flags["simulate_failure"] = False
+    print(f"\nMetrics and settings reset (canary at {CANARY_PERCENTAGE}%)\n")
     return jsonify({"status": "reset"})
 
 
@@ -231,18 +886,25 @@ def status():
     <h1>Canary Deployment Lab</h1>
     <h2>Current Configuration</h2>
     <ul>
-        <li><b>Canary Traffic:</b> {CANARY_PERCENTAGE}%</li>
-        <li><b>Production Traffic:</b> {100 - CANARY_PERCENTAGE}%</li>
+        <li><b>Canary Traffic:</b> {canary_percentage()}%</li>
+        <li><b>Production Traffic:</b> {variant_percentage("production")}%</li>
+        <li><b>Routing Weights:</b> {router.weights()}</li>
         <li><b>Accuracy Threshold:</b> {ACCURACY_THRESHOLD}%</li>
-        <li><b>Failure Simulation:</b> {'ON' if SIMULATE_CANARY_FAILURE else 'OFF'}</li>
+        <li><b>Failure Simulation:</b> {'ON' if flags["simulate_failure"] else 'OFF'}</li>
+        <li><b>Shadow Mode:</b> {'ON' if flags["shadow_mode"] else 'OFF'}</li>
     </ul>
     <h2>Endpoints</h2>
     <ul>
         <li><code>POST /predict</code> - Make prediction</li>
+        <li><code>POST /predict_batch</code> - Bulk predictions (JSON array or JSONL in, JSONL out)</li>
         <li><code>GET /metrics</code> - View metrics</li>
+        <li><code>GET /timings</code> - Per-stage request latency</li>
+        <li><code>GET /profile?seconds=5</code> - Sample hot-path stacks</li>
         <li><code>POST /check_rollback</code> - Check rollback trigger</li>
         <li><code>POST /set_canary/&lt;n&gt;</code> - Set canary %</li>
+        <li><code>POST /set_weights</code> - Set weights for several variants</li>
         <li><code>POST /simulate_failure/1</code> - Enable failure</li>
+        <li><code>POST /shadow/1</code> - Enable shadow mode</li>
         <li><code>POST /reset</code> - Reset everything</li>
     </ul>
     """
@@ -254,6 +916,8 @@ if __name__ == '__main__':
     print("=" * 60)
     print(f"Canary Traffic: {CANARY_PERCENTAGE}%")
     print(f"Accuracy Threshold: {ACCURACY_THRESHOLD}%")
+    if BATCHING_ENABLED:
+        print(f"Micro-batching: up to {BATCH_MAX_SIZE} requests / {BATCH_MAX_WAIT_MS}ms")
     print("=" * 60 + "\n")
 
     app.run(host='0.0.0.0', port=8080, debug=False)
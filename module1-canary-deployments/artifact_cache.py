@@ -0,0 +1,192 @@
+"""
+artifact_cache.py - Local Model Artifact Cache
+
+Keeps a content-addressed copy of registered model artifacts on disk so the
+canary router can start without waiting on (or even reaching) the MLflow
+tracking server.
+
+Cache layout (under MODEL_CACHE_DIR, default ./model_cache):
+
+  objects/<sha256>/            model directory, named by a hash of its files
+  refs/<model>/<version>.json  registry version -> object hash
+  stages/<model>/<stage>.json  last known registry version for a stage
+  startup_times.json           most recent cold and warm router start times
+
+Usage:
+  python artifact_cache.py prefetch   # Download Production + Staging models
+  python artifact_cache.py list       # Show cached versions and stages
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import mlflow
+
+_DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_cache')
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', _DEFAULT_CACHE_DIR)
+
+
+class ArtifactCache:
+    """Content-addressed on-disk store of downloaded model versions."""
+
+    def __init__(self, root=MODEL_CACHE_DIR):
+        self.root = root
+
+    # ---------- paths ----------
+
+    def _object_dir(self, digest):
+        return os.path.join(self.root, "objects", digest)
+
+    def _ref_file(self, model_name, version):
+        return os.path.join(self.root, "refs", model_name, f"{version}.json")
+
+    def _stage_file(self, model_name, stage):
+        return os.path.join(self.root, "stages", model_name, f"{stage}.json")
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_json(path, data):
+        """Write via a temp file + rename so readers never see half a file."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def content_digest(directory):
+        """SHA-256 over every file's relative path and bytes, in sorted order."""
+        digest = hashlib.sha256()
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                digest.update(os.path.relpath(path, directory).encode())
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(block)
+        return digest.hexdigest()
+
+    # ---------- lookups ----------
+
+    def local_path(self, model_name, version):
+        """Directory of a cached model version, or None if not cached."""
+        ref = self._read_json(self._ref_file(model_name, version))
+        if ref is None:
+            return None
+        path = self._object_dir(ref["digest"])
+        return path if os.path.isdir(path) else None
+
+    def stage_version(self, model_name, stage):
+        """Registry version last seen in a stage, or None."""
+        ref = self._read_json(self._stage_file(model_name, stage))
+        return ref["version"] if ref else None
+
+    def record_stage(self, model_name, stage, version):
+        if self.stage_version(model_name, stage) != str(version):
+            self._write_json(self._stage_file(model_name, stage),
+                             {"version": str(version), "updated_at": time.time()})
+
+    # ---------- downloads ----------
+
+    def fetch(self, model_name, version):
+        """Return the local directory for a version, downloading it if needed."""
+        path = self.local_path(model_name, version)
+        if path is not None:
+            return path
+
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        staging_dir = tempfile.mkdtemp(dir=os.path.join(self.root, "objects"), prefix=".download-")
+        try:
+            downloaded = mlflow.artifacts.download_artifacts(
+                artifact_uri=f"models:/{model_name}/{version}", dst_path=staging_dir
+            )
+            digest = self.content_digest(downloaded)
+            object_dir = self._object_dir(digest)
+            try:
+                os.replace(downloaded, object_dir)
+            except OSError:
+                # Another process (e.g. a sibling serve.py worker) stored the
+                # same content first; identical digest, so theirs is ours
+                if not os.path.isdir(object_dir):
+                    raise
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        self._write_json(self._ref_file(model_name, version),
+                         {"version": str(version), "digest": digest, "fetched_at": time.time()})
+        return object_dir
+
+    # ---------- startup timing ----------
+
+    def record_startup(self, kind, total_ms):
+        """Remember the latest 'cold' or 'warm' start time."""
+        path = os.path.join(self.root, "startup_times.json")
+        times = self._read_json(path) or {}
+        times[kind] = {"total_ms": round(total_ms, 1), "at": time.time()}
+        self._write_json(path, times)
+        return times
+
+    def startup_times(self):
+        return self._read_json(os.path.join(self.root, "startup_times.json")) or {}
+
+
+def prefetch(stages=("Production", "Staging"), model_name="sentiment"):
+    """Resolve each stage in the registry and download its model version."""
+    from mlflow.tracking import MlflowClient
+
+    mlflow.set_tracking_uri("http://127.0.0.1:5001")
+    client = MlflowClient()
+    cache = ArtifactCache()
+
+    print(f"\nPre-fetching '{model_name}' into {cache.root}")
+    print("-" * 50)
+    for stage in stages:
+        versions = client.get_latest_versions(model_name, stages=[stage])
+        if not versions:
+            print(f"  {stage:10} no version in this stage")
+            continue
+        version = versions[0].version
+        start = time.perf_counter()
+        path = cache.fetch(model_name, version)
+        cache.record_stage(model_name, stage, version)
+        print(f"  {stage:10} v{version} -> {os.path.basename(path)[:12]} "
+              f"({(time.perf_counter() - start) * 1000:.0f}ms)")
+
+
+def list_cache(model_name="sentiment"):
+    cache = ArtifactCache()
+    refs_dir = os.path.join(cache.root, "refs", model_name)
+    print(f"\nCache: {cache.root}")
+    for filename in sorted(os.listdir(refs_dir)) if os.path.isdir(refs_dir) else []:
+        ref = cache._read_json(os.path.join(refs_dir, filename))
+        print(f"  v{ref['version']:5} {ref['digest'][:12]}")
+    for stage in ("Production", "Staging"):
+        print(f"  {stage:10} -> v{cache.stage_version(model_name, stage)}")
+    print(f"  Startup times: {cache.startup_times()}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "prefetch"
+    if cmd == "prefetch":
+        prefetch()
+    elif cmd == "list":
+        list_cache()
+    else:
+        print("Usage: python artifact_cache.py [prefetch|list]")
@@ -0,0 +1,243 @@
+"""
+asgi_app.py - Async (ASGI) Entry Point for the Canary Router
+
+An alternative to `python app.py` for heavier traffic. The Flask
+development server ties one thread to every request for as long as the
+model runs; here one asyncio event loop accepts all connections and model
+inference runs on a bounded thread pool:
+
+  - At most INFERENCE_WORKERS predictions run at once and at most
+    INFERENCE_QUEUE_SIZE more wait for a worker. Beyond that /predict
+    answers 503 with Retry-After right away instead of queueing without
+    limit (backpressure).
+  - /metrics, /timings, /check_rollback, /set_canary and /reset never
+    touch the inference pool, so they stay responsive while it is
+    saturated. /profile samples on its own thread, and so do the control
+    views that write to stdout (a rollback banner, a weight change), so a
+    slow terminal or pipe never stalls the event loop.
+
+Routing, scoring, metrics and rollback are the same code as app.py: this
+module imports it and calls handle_prediction() and the Flask control views.
+
+Usage:
+  pip install uvicorn
+  python asgi_app.py                  # or: uvicorn asgi_app:app --port 8080
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as canary  # Loads the models and builds router, metrics, evaluator
+from stage_timing import PARSE, SERIALIZE, StageTimer
+
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', '8080'))
+
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', '4'))       # Predictions running at once
+INFERENCE_QUEUE_SIZE = int(os.environ.get('INFERENCE_QUEUE_SIZE', '64'))  # Predictions waiting for a worker
+RETRY_AFTER_SECONDS = 1
+
+executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+
+# Only touched from the event loop thread, so no lock is needed
+inference_stats = {"in_flight": 0, "completed": 0, "rejected": 0, "errors": 0}
+
+# Control endpoints reuse the Flask views. Read-only ones are cheap and run
+# inline; the ones that can print (check_rollback may trigger a rollback and
+# its banner) run on a thread outside the inference pool.
+CONTROL_ROUTES = [
+    ("GET", re.compile(r"^/metrics$"), canary.get_metrics, False),
+    ("GET", re.compile(r"^/timings$"), canary.get_timings, False),
+    ("POST", re.compile(r"^/check_rollback$"), canary.check_rollback, True),
+    ("POST", re.compile(r"^/set_canary/(\d+)$"), canary.set_canary_percentage, True),
+    ("POST", re.compile(r"^/reset$"), canary.reset_metrics, True),
+]
+
+
+def async_server_stats():
+    """Return the async server fields added to /metrics."""
+    return {
+        "inference_workers": INFERENCE_WORKERS,
+        "inference_queue_size": INFERENCE_QUEUE_SIZE,
+        **inference_stats,
+    }
+
+
+# ============================================================
+# HTTP HELPERS
+# ============================================================
+async def read_body(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def header(scope, name):
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+# ============================================================
+# ENDPOINTS
+# ============================================================
+async def predict(scope, receive, send):
+    """Same contract as Flask /predict, with inference on the bounded pool."""
+    timer = StageTimer() if canary.STAGE_TIMING_ENABLED else None
+    try:
+        data = json.loads(await read_body(receive))
+        if not isinstance(data, dict):
+            raise ValueError
+    except ValueError:
+        await send_json(send, 400, {"error": "request body must be a JSON object"})
+        return
+
+    # BACKPRESSURE: refuse instead of queueing without limit
+    if inference_stats["in_flight"] >= INFERENCE_WORKERS + INFERENCE_QUEUE_SIZE:
+        inference_stats["rejected"] += 1
+        await send_json(send, 503, {"error": "inference capacity exhausted, retry later"},
+                        [(b"retry-after", str(RETRY_AFTER_SECONDS).encode())])
+        return
+
+    routing_key = data.get('user_id', header(scope, b"x-user-id"))
+    if timer:
+        timer.mark(PARSE)
+    inference_stats["in_flight"] += 1
+    try:
+        # Time until a pool thread picks this up is charged to the "queue" stage
+        result = await asyncio.get_running_loop().run_in_executor(
+            executor, canary.handle_prediction,
+            data.get('text', ''), data.get('actual_label'), routing_key, timer)
+    except Exception as e:
+        inference_stats["errors"] += 1
+        await send_json(send, 500, {"error": str(e)})
+        return
+    finally:
+        inference_stats["in_flight"] -= 1
+
+    inference_stats["completed"] += 1
+    await send_json(send, 200, result)
+    if timer:
+        timer.mark(SERIALIZE)  # Serialization and handing the response to the server
+        canary.stage_timings.record(result['model_version'], timer)
+
+
+async def profile(scope, send):
+    """/profile on a separate thread so the event loop keeps serving."""
+    query = parse_qs(scope.get("query_string", b"").decode())
+    try:
+        report = await asyncio.to_thread(
+            canary.profiler.profile,
+            float(query.get("seconds", ["5"])[0]),
+            float(query.get("interval_ms", ["5"])[0]),
+            include_idle=query.get("idle", [""])[0] == "1")
+    except ValueError:
+        await send_json(send, 400, {"error": "seconds and interval_ms must be numbers"})
+        return
+    except RuntimeError as e:
+        await send_json(send, 409, {"error": str(e)})
+        return
+    del report["collapsed"]
+    await send_json(send, 200, report)
+
+
+def run_view(view, args):
+    """Call a Flask control view; return (JSON payload, status)."""
+    with canary.app.app_context():
+        response = view(*args)
+    status = 200
+    if isinstance(response, tuple):
+        response, status = response
+    return response.get_json(), status
+
+
+async def control(view, args, send, off_loop):
+    """Run a Flask control view and forward its JSON response."""
+    if off_loop:
+        payload, status = await asyncio.to_thread(run_view, view, args)
+    else:
+        payload, status = run_view(view, args)
+    if view is canary.get_metrics:
+        payload["async_server"] = async_server_stats()
+    await send_json(send, status, payload)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            executor.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application."""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"]
+    if path == "/predict":
+        if method == "POST":
+            await predict(scope, receive, send)
+        else:
+            await send_json(send, 405, {"error": "method not allowed"})
+        return
+
+    for route_method, pattern, view, off_loop in CONTROL_ROUTES:
+        match = pattern.match(path)
+        if match:
+            if method != route_method:
+                await send_json(send, 405, {"error": "method not allowed"})
+                return
+            await read_body(receive)
+            await control(view, [int(arg) for arg in match.groups()], send, off_loop)
+            return
+
+    if path == "/profile" and method == "GET":
+        await profile(scope, send)
+        return
+
+    await send_json(send, 404, {"error": f"no route for {path}"})
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("\n" + "=" * 60)
+    print("CANARY DEPLOYMENT LAB SERVER (async)")
+    print("=" * 60)
+    print(f"Canary Traffic: {canary.CANARY_PERCENTAGE}%")
+    print(f"Accuracy Threshold: {canary.ACCURACY_THRESHOLD}%")
+    print(f"Inference pool: {INFERENCE_WORKERS} workers, {INFERENCE_QUEUE_SIZE} queued before 503")
+    print("=" * 60 + "\n")
+
+    uvicorn.run(app, host=HOST, port=PORT, log_level="warning")
@@ -0,0 +1,199 @@
+"""
+batch_io.py - Streaming Readers for the /predict_batch Endpoint
+
+Parses a request body incrementally so the router never holds the whole
+payload in memory. Two formats are accepted:
+
+  JSON array:  [{"text": "...", "actual_label": 1}, {"text": "..."}]
+  JSONL:       one {"text": "...", "actual_label": 1} object per line
+
+The format is detected from the first non-whitespace byte of the body.
+
+iter_labeled_rows() reads labeled corpus files (CSV, JSON array or JSONL)
+the same way for training and offline evaluation.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import codecs
+import csv
+import json
+import re
+
+READ_SIZE = 64 * 1024  # Bytes read from the request stream at a time
+
+_decoder = json.JSONDecoder()
+_separator = re.compile(r"[\s,]*")
+
+
+class InvalidRecord:
+    """Placeholder yielded for a record that could not be parsed."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _iter_text_chunks(stream):
+    """Yield decoded text from a binary stream without splitting UTF-8 characters."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = stream.read(READ_SIZE)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _parse_line(line):
+    line = line.strip()
+    if not line:
+        return
+    try:
+        yield json.loads(line)
+    except ValueError as e:
+        yield InvalidRecord(f"invalid JSON: {e}")
+
+
+def _iter_jsonl(first_chunk, chunks):
+    buffer = first_chunk
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield from _parse_line(line)
+    for line in buffer.split("\n"):
+        yield from _parse_line(line)
+
+
+def _element_end(buffer, pos):
+    """
+    Index of the ',' or ']' that ends the array element starting at pos, or
+    None if the element continues past the buffered data. Tracks nesting and
+    strings only, so it also finds the end of an element that is not valid
+    JSON.
+    """
+    open_brackets = []
+    i = pos
+    while i < len(buffer):
+        char = buffer[i]
+        if char == '"':
+            i += 1
+            while i < len(buffer) and buffer[i] != '"':
+                i += 2 if buffer[i] == "\\" else 1
+            if i >= len(buffer):
+                return None
+        elif char in "{[":
+            open_brackets.append(char)
+        elif char in "}]":
+            opener = "{" if char == "}" else "["
+            if opener in open_brackets:
+                # Close up to the matching bracket, so a mismatched one inside
+                # the element does not swallow the elements after it
+                del open_brackets[len(open_brackets) - 1 - open_brackets[::-1].index(opener):]
+            elif char == "]":
+                return i
+        elif char == "," and not open_brackets:
+            return i
+        i += 1
+    return None
+
+
+def _iter_json_array(first_chunk, chunks):
+    buffer = first_chunk.lstrip()[1:]  # Drop the opening '['
+    pos = 0
+    exhausted = False
+
+    while True:
+        pos = _separator.match(buffer, pos).end()
+        if buffer.startswith("]", pos):
+            return
+        try:
+            record, pos_after = _decoder.raw_decode(buffer, pos)
+        except ValueError as e:
+            end = _element_end(buffer, pos)
+            if end is not None:
+                # The whole element is buffered, so it is malformed rather than
+                # cut off: report it and carry on with the next one
+                yield InvalidRecord(f"invalid JSON: {e}")
+                pos = end + 1 if buffer[end] == "," else end
+                continue
+            if exhausted:
+                if pos < len(buffer):
+                    yield InvalidRecord(f"invalid JSON array: {e}")
+                return
+            # Not enough data buffered for the next element yet: drop what
+            # has been consumed and read more
+            buffer = buffer[pos:]
+            pos = 0
+            try:
+                buffer += next(chunks)
+            except StopIteration:
+                exhausted = True
+            continue
+        yield record
+        pos = pos_after
+
+
+def iter_records(stream):
+    """Yield one dict (or InvalidRecord) per element of a JSON array or JSONL body."""
+    chunks = _iter_text_chunks(stream)
+    first_chunk = ""
+    for chunk in chunks:
+        first_chunk += chunk
+        if first_chunk.strip():
+            break
+
+    if first_chunk.lstrip().startswith("["):
+        yield from _iter_json_array(first_chunk, chunks)
+    else:
+        yield from _iter_jsonl(first_chunk, chunks)
+
+
+def iter_chunks(records, chunk_size):
+    """Group an iterable into lists of at most chunk_size items."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_raw_rows(path):
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                yield row.get("text"), row.get("label", row.get("actual_label"))
+    else:
+        with open(path, "rb") as f:
+            for record in iter_records(f):
+                if not isinstance(record, dict):
+                    record = {}  # Unparseable line: counted as skipped
+                yield record.get("text"), record.get("label", record.get("actual_label"))
+
+
+def iter_labeled_rows(path, stats=None):
+    """
+    Yield (text, label) rows with label 0 or 1 from a corpus file, lazily.
+    CSV needs a header with `text` and `label` (or `actual_label`) columns;
+    anything else is read as a JSON array or JSONL of such objects. Rows
+    that are malformed or unlabeled are skipped and counted in
+    stats["skipped"] when a stats dict is given.
+    """
+    for text, label in _iter_raw_rows(path):
+        try:
+            label = int(label)
+        except (TypeError, ValueError):
+            label = None
+        if not isinstance(text, str) or not text.strip() or label not in (0, 1):
+            if stats is not None:
+                stats["skipped"] = stats.get("skipped", 0) + 1
+            continue
+        yield text, label
@@ -0,0 +1,108 @@
+"""
+batching.py - Dynamic Micro-Batching for Model Inference
+
+Concurrent /predict requests for the same model version are collected into
+a small batch and scored with ONE vectorized model.predict() call. A batch is
+flushed as soon as it reaches max_batch_size items or the oldest request has
+waited max_wait_ms, whichever comes first. Each waiting request then gets its
+own row of the result back.
+
+This amortizes the fixed per-call cost of the MLflow pyfunc wrapper and the
+TF-IDF + LogisticRegression pipeline across many requests.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import queue
+import threading
+import time
+
+
+class _PendingPrediction:
+    """A single request waiting for its batch to be scored."""
+
+    __slots__ = ("text", "done", "prediction", "error")
+
+    def __init__(self, text):
+        self.text = text
+        self.done = threading.Event()
+        self.prediction = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Collect concurrent requests and score them with one predict() call."""
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5, name="model"):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.name = name
+        self._queue = queue.Queue()
+        self.reset_stats()
+
+        self._worker = threading.Thread(
+            target=self._run, name=f"batcher-{name}", daemon=True
+        )
+        self._worker.start()
+
+    def reset_stats(self):
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    def predict(self, text, timeout=30):
+        """Submit one text and block until its batch has been scored."""
+        pending = _PendingPrediction(text)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError(f"Batch for {self.name} was not scored within {timeout}s")
+        if pending.error is not None:
+            raise pending.error
+        return pending.prediction
+
+    def _collect_batch(self):
+        """Block for the first request, then fill the batch until size or deadline."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                predictions = self.predict_fn([p.text for p in batch])
+                for pending, prediction in zip(batch, predictions):
+                    pending.prediction = prediction
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+
+            for pending in batch:
+                pending.done.set()
+
+    def stats(self):
+        """Return the batching fields exposed by /metrics."""
+        avg_batch = self.items / self.batches if self.batches else 0
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(avg_batch, 2),
+            "largest_batch": self.largest_batch,
+            "queue_depth": self._queue.qsize(),
+        }
@@ -0,0 +1,151 @@
+"""
+bench_serving.py - Compare the Flask and Async Router Under Load
+
+Drives one or more running routers with a fixed number of concurrent
+clients and reports throughput and tail latency for /predict, plus the
+latency of /metrics requests made while /predict is saturated.
+
+Start the servers on different ports, then point the benchmark at both:
+
+  python app.py                                 # Flask, port 8080
+  PORT=8081 python asgi_app.py                  # Async, port 8081
+  python bench_serving.py flask=http://127.0.0.1:8080 async=http://127.0.0.1:8081
+
+Options (env): BENCH_CONCURRENCY (default 64), BENCH_SECONDS (default 10).
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from metrics_core import LatencyHistogram
+from send_requests import TEST_DATA
+
+BENCH_CONCURRENCY = int(os.environ.get('BENCH_CONCURRENCY', '64'))
+BENCH_SECONDS = float(os.environ.get('BENCH_SECONDS', '10'))
+CONTROL_INTERVAL_SECONDS = 0.1
+
+
+class Client:
+    """One keep-alive HTTP connection, reopened after errors."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.conn = None
+
+    def request(self, method, path, payload=None):
+        """Return the status code (0 if the request failed)."""
+        body = json.dumps(payload) if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body else {}
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+            if response.getheader("Connection", "").lower() == "close":
+                self.close()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return 0
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def run_benchmark(url, concurrency=BENCH_CONCURRENCY, seconds=BENCH_SECONDS):
+    """Saturate /predict from `concurrency` threads and probe /metrics meanwhile."""
+    predict_latency = LatencyHistogram()
+    control_latency = LatencyHistogram()
+    statuses = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def predict_loop(worker):
+        client = Client(url)
+        latency = LatencyHistogram()
+        counts = {}
+        n = 0
+        while not stop.is_set():
+            sample = TEST_DATA[n % len(TEST_DATA)]
+            # Unique text per request so the prediction cache does not answer
+            payload = {**sample, "text": f"{sample['text']} #{worker}-{n}", "user_id": f"bench-{worker}"}
+            start = time.perf_counter()
+            status = client.request("POST", "/predict", payload)
+            if status == 200:
+                latency.record((time.perf_counter() - start) * 1000)
+            counts[status] = counts.get(status, 0) + 1
+            n += 1
+        client.close()
+        with lock:
+            predict_latency.merge(latency)
+            for status, count in counts.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    def control_loop():
+        client = Client(url)
+        while not stop.wait(CONTROL_INTERVAL_SECONDS):
+            start = time.perf_counter()
+            if client.request("GET", "/metrics") == 200:
+                control_latency.record((time.perf_counter() - start) * 1000)
+        client.close()
+
+    Client(url).request("POST", "/reset")
+    threads = [threading.Thread(target=predict_loop, args=(i,)) for i in range(concurrency)]
+    threads.append(threading.Thread(target=control_loop))
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "throughput_rps": round(predict_latency.count / elapsed, 1),
+        "statuses": statuses,
+        "predict": predict_latency.summary(),
+        "metrics_under_load": control_latency.summary(),
+    }
+
+
+def print_comparison(results):
+    print("\n" + "=" * 78)
+    print(f"SERVING BENCHMARK ({BENCH_CONCURRENCY} clients, {BENCH_SECONDS:.0f}s each)")
+    print("=" * 78)
+    print(f"  {'Server':10} {'OK req/s':>9} {'P50':>8} {'P95':>8} {'P99':>8} {'Max':>9} "
+          f"{'Rejected':>9} {'/metrics P99':>13}")
+    print("  " + "-" * 76)
+    for label, r in results.items():
+        p = r["predict"]
+        rejected = sum(count for status, count in r["statuses"].items() if status != 200)
+        print(f"  {label:10} {r['throughput_rps']:>9} {p['p50_latency_ms']:>7}ms {p['p95_latency_ms']:>7}ms "
+              f"{p['p99_latency_ms']:>7}ms {p['max_latency_ms']:>8}ms {rejected:>9} "
+              f"{r['metrics_under_load']['p99_latency_ms']:>11}ms")
+    print("=" * 78 + "\n")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    results = {}
+    for arg in sys.argv[1:]:
+        label, _, url = arg.rpartition("=")
+        label = label or url
+        print(f"Benchmarking {label} ({url})...")
+        results[label] = run_benchmark(url)
+    print_comparison(results)
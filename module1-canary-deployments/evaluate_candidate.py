@@ -0,0 +1,282 @@
+"""
+evaluate_candidate.py - Offline Evaluation Gate Before Promotion
+
+Scores a labeled dataset through the Production model and a candidate
+version before the candidate gets any live traffic, instead of finding out
+from /check_rollback after users have seen it.
+
+For every row both models predict; the dataset is streamed in chunks and
+scored in vectorized predict() calls on a pool of worker processes, so
+memory stays bounded whatever the dataset size. The report contains:
+
+  - accuracy of each model with a 95% confidence interval
+  - accuracy difference (candidate - production) with a 95% confidence
+    interval, from the paired per-row results
+  - disagreement rate: rows where the two models predict differently
+  - latency: single-row predict() p50/p95/p99 on a sample of rows (what
+    the router pays per request) and the per-row cost of chunked scoring
+
+The candidate passes the gate only if it meets every budget (see GATE
+BUDGETS). A failing candidate is never moved to Staging.
+
+Usage:
+  python evaluate_candidate.py eval.jsonl 3   # Gate version 3; Staging if it passes
+  python evaluate_candidate.py eval.csv       # Re-check the current Staging version
+
+Exit code 0 when the candidate passes, 1 when it fails.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import math
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import mlflow
+import mlflow.pyfunc
+from mlflow.tracking import MlflowClient
+
+from artifact_cache import ArtifactCache
+from batch_io import iter_chunks, iter_labeled_rows
+from metrics_core import LatencyHistogram
+
+MODEL_NAME = "sentiment"
+MODEL_CACHE_ENABLED = os.environ.get('MODEL_CACHE_ENABLED', 'true').lower() == 'true'
+
+EVAL_CHUNK_SIZE = int(os.environ.get('EVAL_CHUNK_SIZE', '1000'))               # Rows per predict() call
+EVAL_WORKERS = int(os.environ.get('EVAL_WORKERS', str(os.cpu_count() or 1)))   # Scoring processes
+EVAL_LATENCY_SAMPLE = int(os.environ.get('EVAL_LATENCY_SAMPLE', '20'))         # Single-row timings per chunk
+Z_95 = 1.96
+
+# ============================================================
+# GATE BUDGETS
+# ============================================================
+# Defaults match the router's rollback thresholds in app.py, so a candidate
+# that passes here would not be rolled back for the same reasons live.
+GATE_MIN_ACCURACY = float(os.environ.get('GATE_MIN_ACCURACY', '85'))           # Percent
+GATE_MAX_ACCURACY_DROP = float(os.environ.get('GATE_MAX_ACCURACY_DROP', '1'))  # Points, at the CI lower bound
+GATE_MAX_P95_MS = float(os.environ.get('GATE_MAX_P95_MS', '100'))              # Single-row p95
+GATE_MAX_LATENCY_RATIO = float(os.environ.get('GATE_MAX_LATENCY_RATIO', '2'))  # Candidate p95 / production p95
+
+
+# ============================================================
+# WORKER PROCESSES
+# ============================================================
+_models = {}
+
+
+def _load_models(model_uris):
+    """Pool initializer: every worker loads both models once."""
+    for name, uri in model_uris.items():
+        _models[name] = mlflow.pyfunc.load_model(uri)
+
+
+def _score_chunk(texts, labels):
+    """Score one chunk with both models; return counts and timings only."""
+    result = {"rows": len(texts), "single_row_ms": {}, "chunk_ms": {}}
+    predictions = {}
+    for name, model in _models.items():
+        start = time.perf_counter()
+        predictions[name] = [int(p) for p in model.predict(texts)]
+        result["chunk_ms"][name] = (time.perf_counter() - start) * 1000
+        timings = []
+        for text in texts[:EVAL_LATENCY_SAMPLE]:
+            start = time.perf_counter()
+            model.predict([text])
+            timings.append((time.perf_counter() - start) * 1000)
+        result["single_row_ms"][name] = timings
+
+    production, candidate = predictions["production"], predictions["candidate"]
+    result["production_correct"] = sum(p == y for p, y in zip(production, labels))
+    result["candidate_correct"] = sum(c == y for c, y in zip(candidate, labels))
+    result["candidate_only_correct"] = sum(c == y != p for p, c, y in zip(production, candidate, labels))
+    result["production_only_correct"] = sum(p == y != c for p, c, y in zip(production, candidate, labels))
+    result["disagreements"] = sum(p != c for p, c in zip(production, candidate))
+    return result
+
+
+# ============================================================
+# EVALUATION
+# ============================================================
+def model_uri(version):
+    if MODEL_CACHE_ENABLED:
+        return ArtifactCache().fetch(MODEL_NAME, version)  # Download once, load from disk in every worker
+    return f"models:/{MODEL_NAME}/{version}"
+
+
+def iter_scored(path, model_uris, stats):
+    """Yield per-chunk results; at most two chunks per worker are in flight."""
+    chunks = (([text for text, _ in chunk], [label for _, label in chunk])
+              for chunk in iter_chunks(iter_labeled_rows(path, stats), EVAL_CHUNK_SIZE))
+    with ProcessPoolExecutor(max_workers=EVAL_WORKERS, initializer=_load_models,
+                             initargs=(model_uris,)) as pool:
+        pending = deque()
+        for texts, labels in chunks:
+            pending.append(pool.submit(_score_chunk, texts, labels))
+            if len(pending) >= EVAL_WORKERS * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def wilson_interval(successes, n, z=Z_95):
+    """95% confidence interval for a proportion, in percent."""
+    if n == 0:
+        return 0.0, 0.0
+    p = successes / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return round((center - margin) * 100, 2), round((center + margin) * 100, 2)
+
+
+def paired_difference(candidate_only, production_only, n, z=Z_95):
+    """
+    Candidate minus production accuracy with a 95% CI, in points. Each row
+    contributes +1, -1 or 0, so the variance comes from the rows where
+    exactly one model was right.
+    """
+    if n == 0:
+        return 0.0, (0.0, 0.0)
+    mean = (candidate_only - production_only) / n
+    variance = (candidate_only + production_only) / n - mean * mean
+    margin = z * math.sqrt(max(variance, 0.0) / n)
+    return round(mean * 100, 2), (round((mean - margin) * 100, 2), round((mean + margin) * 100, 2))
+
+
+def evaluate(path, production_version, candidate_version):
+    """Score the dataset through both versions and return the report."""
+    model_uris = {"production": model_uri(production_version),
+                  "candidate": model_uri(candidate_version)}
+    totals = dict.fromkeys(("rows", "production_correct", "candidate_correct", "candidate_only_correct",
+                            "production_only_correct", "disagreements"), 0)
+    single_row = {name: LatencyHistogram() for name in model_uris}
+    per_row = {name: LatencyHistogram() for name in model_uris}
+    stats = {"skipped": 0}
+    start = time.time()
+
+    for result in iter_scored(path, model_uris, stats):
+        for key in totals:
+            totals[key] += result[key]
+        for name in model_uris:
+            for latency in result["single_row_ms"][name]:
+                single_row[name].record(latency)
+            per_row[name].record(result["chunk_ms"][name] / result["rows"])
+
+    n = totals["rows"]
+    difference, difference_ci = paired_difference(
+        totals["candidate_only_correct"], totals["production_only_correct"], n)
+    report = {
+        "dataset": os.path.abspath(path),
+        "rows": n,
+        "skipped_rows": stats["skipped"],
+        "seconds": round(time.time() - start, 1),
+        "accuracy_difference": difference,
+        "accuracy_difference_ci": difference_ci,
+        "disagreement_rate": round(totals["disagreements"] / n * 100, 2) if n else 0.0,
+    }
+    for name, version in (("production", production_version), ("candidate", candidate_version)):
+        correct = totals[f"{name}_correct"]
+        report[name] = {
+            "version": str(version),
+            "accuracy": round(correct / n * 100, 2) if n else 0.0,
+            "accuracy_ci": wilson_interval(correct, n),
+            "single_row_latency": single_row[name].summary(digits=3),
+            "chunked_per_row_ms": per_row[name].summary(digits=4),
+        }
+    return report
+
+
+def check_budgets(report):
+    """Return the list of failed budgets (empty when the candidate passes)."""
+    failures = []
+    if report["rows"] == 0:
+        return ["no labeled rows in the dataset"]
+    candidate, production = report["candidate"], report["production"]
+    if candidate["accuracy"] < GATE_MIN_ACCURACY:
+        failures.append(f"accuracy {candidate['accuracy']}% < {GATE_MIN_ACCURACY}%")
+    if report["accuracy_difference_ci"][0] < -GATE_MAX_ACCURACY_DROP:
+        failures.append(f"accuracy may be up to {-report['accuracy_difference_ci'][0]} points below "
+                        f"production (budget {GATE_MAX_ACCURACY_DROP})")
+    candidate_p95 = candidate["single_row_latency"]["p95_latency_ms"]
+    production_p95 = production["single_row_latency"]["p95_latency_ms"]
+    if candidate_p95 > GATE_MAX_P95_MS:
+        failures.append(f"p95 latency {candidate_p95}ms > {GATE_MAX_P95_MS}ms")
+    if production_p95 and candidate_p95 > production_p95 * GATE_MAX_LATENCY_RATIO:
+        failures.append(f"p95 latency {candidate_p95}ms > {GATE_MAX_LATENCY_RATIO}x "
+                        f"production ({production_p95}ms)")
+    return failures
+
+
+def print_report(report, failures):
+    print("\n" + "=" * 60)
+    print("CANDIDATE EVALUATION")
+    print("=" * 60)
+    print(f"Dataset: {report['dataset']} ({report['rows']} rows, {report['skipped_rows']} skipped, "
+          f"{report['seconds']}s)")
+    for name in ("production", "candidate"):
+        result = report[name]
+        latency = result["single_row_latency"]
+        print(f"\n{name.upper()} (v{result['version']})")
+        print(f"  Accuracy: {result['accuracy']}%  (95% CI {result['accuracy_ci'][0]}-{result['accuracy_ci'][1]})")
+        print(f"  Single-row latency: p50={latency['p50_latency_ms']}ms p95={latency['p95_latency_ms']}ms "
+              f"p99={latency['p99_latency_ms']}ms")
+        print(f"  Chunked scoring: {result['chunked_per_row_ms']['p50_latency_ms']}ms per row (p50)")
+    low, high = report["accuracy_difference_ci"]
+    print(f"\nAccuracy difference: {report['accuracy_difference']:+} points  (95% CI {low:+} to {high:+})")
+    print(f"Disagreement rate: {report['disagreement_rate']}%")
+    print("-" * 60)
+    if failures:
+        print("GATE: FAIL")
+        for failure in failures:
+            print(f"  - {failure}")
+    else:
+        print("GATE: PASS")
+    print("=" * 60)
+
+
+def gate(path, candidate_version=None):
+    """
+    Evaluate a candidate against Production. An explicitly given version is
+    moved to Staging only if it passes; without one the current Staging
+    version is re-checked. Returns True when the candidate passes.
+    """
+    mlflow.set_tracking_uri("http://127.0.0.1:5001")
+    client = MlflowClient()
+
+    def stage_version(stage):
+        versions = client.get_latest_versions(MODEL_NAME, stages=[stage])
+        if not versions:
+            raise RuntimeError(f"No '{MODEL_NAME}' version is in stage {stage}")
+        return versions[0].version
+
+    production_version = stage_version("Production")
+    if candidate_version is None:
+        candidate_version = stage_version("Staging")
+        promote = False
+    else:
+        promote = True
+
+    report = evaluate(path, production_version, candidate_version)
+    failures = check_budgets(report)
+    print_report(report, failures)
+
+    if failures:
+        if promote:
+            print(f"Version {candidate_version} NOT moved to Staging")
+        return False
+    if promote:
+        client.transition_model_version_stage(name=MODEL_NAME, version=str(candidate_version), stage="Staging")
+        print(f"Version {candidate_version} set to Staging (Canary)")
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python evaluate_candidate.py <dataset.csv|.jsonl> [candidate_version]")
+        sys.exit(1)
+    passed = gate(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,188 @@
+"""
+fast_path.py - Native sklearn Fast Path for Single-Row Predictions
+
+The sentiment models from setup_models.create_model are sklearn Pipelines
+(TfidfVectorizer + LogisticRegression). Serving them through mlflow.pyfunc
+adds input schema handling and a pandas conversion on every call, which
+dominates the cost of scoring one short text.
+
+SklearnFastPath reuses the fitted vocabulary, IDF weights and coefficients
+directly: it tokenizes with the vectorizer's own analyzer, builds the
+L2-normalized TF-IDF weights for just the tokens present and takes the dot
+product with the coefficient vector. No DataFrame, no sparse matrix.
+
+FastPathModel wraps it with the pyfunc model it replaces, checks both give
+the same answers when loaded, and times both paths on a sample of requests.
+The pyfunc side of that comparison runs on a background thread with the
+same inputs, so sampled requests are not slowed down by it and the
+latency the router records stays the fast path's.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import math
+import queue
+import random
+import threading
+import time
+from collections import Counter
+
+from metrics_core import LatencyHistogram
+
+COMPARISON_QUEUE_SIZE = 100  # Sampled comparisons waiting for the comparison thread
+
+# Texts scored by both paths when a model is loaded
+EQUIVALENCE_TEXTS = [
+    "This product is amazing, love it!",
+    "Terrible quality, very disappointed",
+    "Great value for money, highly recommend",
+    "Worst purchase I ever made",
+    "Not worth the money at all",
+    "",
+    "ok",
+]
+
+
+class SklearnFastPath:
+    """Lean TF-IDF + binary LogisticRegression scorer."""
+
+    def __init__(self, pipeline):
+        steps = getattr(pipeline, "named_steps", {})
+        vectorizer, clf = steps.get("tfidf"), steps.get("clf")
+        if vectorizer is None or clf is None or not hasattr(vectorizer, "idf_"):
+            raise ValueError("Fast path needs a fitted Pipeline with 'tfidf' and 'clf' steps")
+        if len(clf.classes_) != 2 or vectorizer.norm not in ("l2", None):
+            raise ValueError("Fast path supports binary classifiers with l2 or no norm only")
+
+        self._analyzer = vectorizer.build_analyzer()
+        self._sublinear_tf = vectorizer.sublinear_tf
+        self._normalize = vectorizer.norm == "l2"
+
+        # token -> (idf weight, coefficient): one dict lookup per token
+        idf = vectorizer.idf_.tolist()
+        coef = clf.coef_[0].tolist()
+        self._weights = {token: (idf[i], coef[i]) for token, i in vectorizer.vocabulary_.items()}
+        self._intercept = float(clf.intercept_[0])
+        self._classes = clf.classes_.tolist()
+
+    def decision(self, text):
+        """Signed distance from the decision boundary (same as decision_function)."""
+        weighted_sum = 0.0
+        squared_norm = 0.0
+        for token, count in Counter(self._analyzer(text)).items():
+            weights = self._weights.get(token)
+            if weights is None:
+                continue
+            tf = 1.0 + math.log(count) if self._sublinear_tf else count
+            value = tf * weights[0]
+            weighted_sum += value * weights[1]
+            squared_norm += value * value
+
+        if self._normalize and squared_norm > 0:
+            weighted_sum /= math.sqrt(squared_norm)
+        return weighted_sum + self._intercept
+
+    def predict(self, texts):
+        return [self._classes[1] if self.decision(t) > 0 else self._classes[0] for t in texts]
+
+
+class FastPathModel:
+    """
+    Serves predictions from SklearnFastPath, keeping the pyfunc model for the
+    load-time equivalence check and sampled latency comparison.
+    """
+
+    def __init__(self, pipeline, pyfunc_model, compare_rate=0.05):
+        self.fast_path = SklearnFastPath(pipeline)
+        self.pyfunc_model = pyfunc_model
+        self.compare_rate = compare_rate
+        self.fast_latency = LatencyHistogram()
+        self.pyfunc_latency = LatencyHistogram()
+        self.comparisons = 0
+        self.comparisons_dropped = 0
+        self.comparison_errors = 0
+        self.mismatches = 0
+        self._lock = threading.Lock()
+        self.check_equivalence(pipeline)
+
+    def check_equivalence(self, pipeline):
+        """Refuse to serve if the fast path disagrees with pyfunc or sklearn."""
+        fast_labels = self.fast_path.predict(EQUIVALENCE_TEXTS)
+        pyfunc_labels = [int(p) for p in self.pyfunc_model.predict(EQUIVALENCE_TEXTS)]
+        if fast_labels != pyfunc_labels:
+            raise ValueError(f"Fast path predictions {fast_labels} != pyfunc {pyfunc_labels}")
+
+        expected = pipeline.decision_function(EQUIVALENCE_TEXTS).tolist()
+        for text, want in zip(EQUIVALENCE_TEXTS, expected):
+            if not math.isclose(self.fast_path.decision(text), want, rel_tol=1e-6, abs_tol=1e-9):
+                raise ValueError(f"Fast path score differs from sklearn for {text!r}")
+
+    def predict(self, texts):
+        start = time.perf_counter()
+        predictions = self.fast_path.predict(texts)
+        fast_ms = (time.perf_counter() - start) * 1000
+
+        if random.random() < self.compare_rate and not _comparisons.submit(self, list(texts), predictions, fast_ms):
+            with self._lock:
+                self.comparisons_dropped += 1
+        return predictions
+
+    def compare(self, texts, predictions, fast_ms):
+        """Score the same inputs through pyfunc; runs on the comparison thread."""
+        start = time.perf_counter()
+        pyfunc_predictions = [int(p) for p in self.pyfunc_model.predict(texts)]
+        pyfunc_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.fast_latency.record(fast_ms)
+            self.pyfunc_latency.record(pyfunc_ms)
+            self.comparisons += 1
+            if pyfunc_predictions != predictions:
+                self.mismatches += 1
+
+    def stats(self):
+        """Return the fast path comparison fields exposed by /metrics."""
+        fast_p50 = self.fast_latency.percentile(50)
+        pyfunc_p50 = self.pyfunc_latency.percentile(50)
+        return {
+            "compare_rate": self.compare_rate,
+            "comparisons": self.comparisons,
+            "comparisons_dropped": self.comparisons_dropped,
+            "comparison_errors": self.comparison_errors,
+            "mismatches": self.mismatches,
+            "fast_path": self.fast_latency.summary(digits=3),
+            "pyfunc": self.pyfunc_latency.summary(digits=3),
+            "p50_speedup": round(pyfunc_p50 / fast_p50, 1) if fast_p50 else None,
+        }
+
+
+class _ComparisonQueue:
+    """
+    One background thread running sampled pyfunc comparisons. Comparisons
+    are only a sample, so when it falls behind new ones are dropped instead
+    of queueing up behind it; each model counts its own drops.
+    """
+
+    def __init__(self, queue_size=COMPARISON_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=queue_size)
+        threading.Thread(target=self._run, name="fast-path-compare", daemon=True).start()
+
+    def submit(self, model, texts, predictions, fast_ms):
+        """Queue one comparison for `model`. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait((model, texts, predictions, fast_ms))
+        except queue.Full:
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            model, texts, predictions, fast_ms = self._queue.get()
+            try:
+                model.compare(texts, predictions, fast_ms)
+            except Exception:
+                with model._lock:
+                    model.comparison_errors += 1
+
+
+_comparisons = _ComparisonQueue()
@@ -0,0 +1,125 @@
+"""
+log_sink.py - Sampled, Non-Blocking Log Sink
+
+Printing a line per request from the request thread puts terminal or log
+collector speed on the prediction hot path: a slow consumer blocks the
+print, and with it the request.
+
+LogSink takes structured records instead:
+
+  - log(event, **fields) keeps a sample of records (LOG_SAMPLE_RATE) and
+    appends them to a fixed-size in-memory ring buffer. It never waits:
+    when the buffer is full the record is dropped and counted.
+  - A background writer thread formats buffered records (text or JSON
+    lines) and writes them to the stream in batches.
+  - always(text) is for messages that must never be sampled or dropped,
+    like rollback banners; it writes synchronously.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import json
+import random
+import sys
+import threading
+import time
+
+
+class LogSink:
+    """Bounded ring buffer of log records drained by a writer thread."""
+
+    def __init__(self, sample_rate=1.0, capacity=10000, log_format="text",
+                 formatters=None, stream=None, flush_interval=0.1):
+        """formatters maps an event name to fields -> text (used in text format)."""
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self.capacity = max(1, int(capacity))
+        self.log_format = log_format
+        self.formatters = dict(formatters or {})
+        self.stream = stream or sys.stdout
+        self.flush_interval = flush_interval
+
+        self._ring = [None] * self.capacity
+        self._head = 0    # Next record to write
+        self._size = 0    # Records waiting
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()  # Keeps lines of different writers whole
+        self.reset_stats()
+
+        threading.Thread(target=self._run, name="log-sink", daemon=True).start()
+
+    def reset_stats(self):
+        self.logged = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.written = 0
+        self.write_errors = 0
+
+    def log(self, event, **fields):
+        """Queue a record if sampled. Never blocks on the output stream."""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return False
+
+        record = (time.time(), event, fields)
+        with self._lock:
+            if self._size == self.capacity:
+                self.dropped += 1
+                return False
+            self._ring[(self._head + self._size) % self.capacity] = record
+            self._size += 1
+            self.logged += 1
+            self._ready.notify()
+        return True
+
+    def always(self, text):
+        """Write a message now, bypassing sampling and the buffer."""
+        self._write(text + "\n")
+
+    def _format(self, record):
+        timestamp, event, fields = record
+        if self.log_format == "json":
+            return json.dumps({"ts": round(timestamp, 6), "event": event, **fields})
+        formatter = self.formatters.get(event)
+        if formatter is not None:
+            return formatter(fields)
+        return f"{event} {fields}"
+
+    def _write(self, text):
+        with self._write_lock:
+            try:
+                self.stream.write(text)
+                self.stream.flush()
+            except (OSError, ValueError):
+                self.write_errors += 1
+
+    def _run(self):
+        while True:
+            with self._ready:
+                if self._size == 0:
+                    self._ready.wait(self.flush_interval)
+                batch = []
+                while self._size:
+                    batch.append(self._ring[self._head])
+                    self._ring[self._head] = None
+                    self._head = (self._head + 1) % self.capacity
+                    self._size -= 1
+            if batch:
+                # Formatting and the possibly slow write happen outside the lock
+                self._write("".join(self._format(r) + "\n" for r in batch))
+                self.written += len(batch)
+
+    def stats(self):
+        """Return the logging fields exposed by /metrics."""
+        return {
+            "sample_rate": self.sample_rate,
+            "format": self.log_format,
+            "capacity": self.capacity,
+            "buffered": self._size,
+            "logged": self.logged,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "written": self.written,
+            "write_errors": self.write_errors,
+        }
@@ -0,0 +1,122 @@
+"""
+model_watcher.py - Zero-Downtime Hot Reload of Registry Models
+
+A background thread polls the MLflow Model Registry for the version that
+currently holds each stage (Production / Staging). When a stage points at a
+new version, the watcher:
+
+  1. Loads the new model on the watcher thread (off the request path)
+  2. Warms it up with a few predictions
+  3. Atomically swaps it into the router
+
+Requests that already picked up the old model keep using it until they
+finish; new requests see the new model as soon as the swap happens.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import threading
+import time
+
+# Texts used to warm a freshly loaded model before it takes traffic
+WARMUP_TEXTS = [
+    "This product is amazing, love it!",
+    "Terrible quality, very disappointed",
+    "Great value for money, highly recommend",
+]
+
+
+class ModelWatcher:
+    """Poll registry stages and hot-swap models when a stage changes."""
+
+    def __init__(self, stages, resolve_version, load_model, install_model,
+                 current_version, interval_seconds=30):
+        """
+        stages:          {"production": "Production", "canary": "Staging"}
+        resolve_version: stage -> registry version currently in that stage
+        load_model:      registry version -> loaded model
+        install_model:   (model_version, model, registry version) -> None
+        current_version: model_version -> registry version being served
+        """
+        self.stages = stages
+        self.resolve_version = resolve_version
+        self.load_model = load_model
+        self.install_model = install_model
+        self.current_version = current_version
+        self.interval_seconds = interval_seconds
+
+        self.reloads = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_reload = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, check_now=False):
+        self._thread = threading.Thread(target=self._run, args=(check_now,),
+                                        name="model-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, check_now):
+        if check_now:
+            self.check_once()
+        while not self._stop.wait(self.interval_seconds):
+            self.check_once()
+
+    def check_once(self):
+        """Check every loaded stage once; reload any whose version changed."""
+        for model_version, stage in self.stages.items():
+            current = self.current_version(model_version)
+            if current is None:
+                continue  # Not loaded yet (lazy) - nothing to keep fresh
+            try:
+                registry_version = str(self.resolve_version(stage))
+                if registry_version != current:
+                    self.reload(model_version, registry_version)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"{model_version}: {e}"
+                print(f"\nModel reload check failed for {model_version}: {e}\n")
+
+    def reload(self, model_version, registry_version):
+        """Load, warm and swap in one model version."""
+        old_version = self.current_version(model_version)
+
+        start = time.perf_counter()
+        model = self.load_model(registry_version)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        model.predict(WARMUP_TEXTS)
+        warmup_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        self.install_model(model_version, model, registry_version)
+        swap_ms = (time.perf_counter() - start) * 1000
+
+        self.reloads += 1
+        self.last_reload = {
+            "model_version": model_version,
+            "from_version": old_version,
+            "to_version": registry_version,
+            "load_ms": round(load_ms, 1),
+            "warmup_ms": round(warmup_ms, 1),
+            "swap_ms": round(swap_ms, 3),
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        print(f"\nHot reload: {model_version} v{old_version} -> v{registry_version} "
+              f"(load {load_ms:.0f}ms, warmup {warmup_ms:.0f}ms, swap {swap_ms:.2f}ms)\n")
+
+    def stats(self):
+        """Return the reload fields exposed by /metrics."""
+        return {
+            "interval_seconds": self.interval_seconds,
+            "reloads": self.reloads,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_reload": self.last_reload,
+        }
@@ -0,0 +1,102 @@
+"""
+prediction_cache.py - Versioned LRU Prediction Cache
+
+Caches raw model predictions keyed on (model name, registry version,
+normalized text). Because the registry version is part of the key, a cached
+prediction can only ever be served by the exact model version that produced
+it. When a different version is installed for a stage, entries belonging to
+the old version are purged.
+
+Entries expire after a TTL and the least recently used entry is evicted once
+the cache is full.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Lowercase and collapse whitespace - the TF-IDF tokenizer ignores both."""
+    return " ".join(str(text).lower().split())
+
+
+class PredictionCache:
+    """Thread-safe LRU cache with TTL and a size bound."""
+
+    def __init__(self, max_entries=10000, ttl_seconds=300):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self._entries = OrderedDict()   # key -> (expires_at, prediction)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(model_name, model_version, text):
+        return (model_name, str(model_version), normalize_text(text))
+
+    def get(self, key):
+        """Return the cached prediction for key, or None on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, prediction = entry
+            if expires_at < now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return prediction
+
+    def put(self, key, prediction):
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires_at, prediction)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_model(self, model_name, model_version):
+        """Drop every entry produced by one version of a model."""
+        model_version = str(model_version)
+        with self._lock:
+            stale = [k for k in self._entries if k[0] == model_name and k[1] == model_version]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the cache fields exposed by /metrics."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups * 100, 1) if lookups else 0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
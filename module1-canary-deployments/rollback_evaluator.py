@@ -0,0 +1,287 @@
+"""
+rollback_evaluator.py - Continuous Sequential Rollback Evaluation
+
+Replaces "poll /check_rollback and compare lifetime accuracy" with a
+background evaluator that reacts as soon as there is statistically
+significant evidence that a canary is bad.
+
+Per request (O(1)):
+  - The observation lands in the current bucket of a time-bucketed sliding
+    window (requests, correct predictions, slow requests, latency
+    histogram).
+
+Every evaluation interval the background thread runs two sequential tests
+over the buckets still inside the window, oldest first:
+    accuracy: H0 "accuracy >= threshold + margin" vs
+              H1 "accuracy <= threshold - margin"
+    latency:  H0 "<= 5% of requests slower than LATENCY_THRESHOLD" (p95 ok)
+              vs H1 ">= 15% slower" (p95 clearly above the threshold)
+Each is a repeated SPRT (Page's CUSUM): every bucket adds its
+log-likelihood ratio and the sum is never allowed below zero. Evidence
+leaves the test when its bucket leaves the window, so a canary with a long
+good history is judged on the last window only and trips as quickly as a
+new one; good requests earlier in the bucket where the failure starts are
+the only history that delays it. A statistic at or above the SPRT
+boundary log((1 - beta) / alpha) triggers a rollback through a callback.
+
+Observations can also arrive as aggregated counts (record_counts), e.g.
+from a feed that reads the shared metrics of several worker processes
+before each evaluation. They land in the same buckets, so both paths give
+the same statistic.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import math
+import threading
+import time
+
+from metrics_core import LatencyHistogram
+
+# Slow-request rates used by the latency test (see module docstring)
+ACCEPTABLE_SLOW_RATE = 0.05
+UNACCEPTABLE_SLOW_RATE = 0.15
+
+
+class _Bucket:
+    __slots__ = ("epoch", "requests", "labeled", "correct", "slow", "latency")
+
+    def __init__(self, epoch):
+        self.epoch = epoch
+        self.requests = 0
+        self.labeled = 0
+        self.correct = 0
+        self.slow = 0
+        self.latency = LatencyHistogram()
+
+
+class SlidingWindow:
+    """Ring of time buckets; old buckets are recycled as time moves on."""
+
+    def __init__(self, window_seconds=60, buckets=12):
+        self.buckets = max(1, int(buckets))
+        self.bucket_seconds = window_seconds / self.buckets
+        self._ring = [_Bucket(-1) for _ in range(self.buckets)]
+
+    def _bucket(self, now):
+        epoch = int(now // self.bucket_seconds)
+        bucket = self._ring[epoch % self.buckets]
+        if bucket.epoch != epoch:
+            bucket = self._ring[epoch % self.buckets] = _Bucket(epoch)
+        return bucket
+
+    def record(self, now, correct, latency_ms, slow):
+        bucket = self._bucket(now)
+        bucket.requests += 1
+        bucket.slow += int(slow)
+        bucket.latency.record(latency_ms)
+        if correct is not None:
+            bucket.labeled += 1
+            bucket.correct += int(correct)
+
+    def record_counts(self, now, requests, labeled, correct, slow, latency):
+        bucket = self._bucket(now)
+        bucket.requests += requests
+        bucket.labeled += labeled
+        bucket.correct += correct
+        bucket.slow += slow
+        bucket.latency.merge(latency)
+
+    def live_buckets(self, now):
+        """Buckets still inside the window, oldest first."""
+        oldest = int(now // self.bucket_seconds) - self.buckets + 1
+        return sorted((bucket for bucket in self._ring if bucket.epoch >= oldest),
+                      key=lambda bucket: bucket.epoch)
+
+    def summary(self, now):
+        """Merge the buckets still inside the window."""
+        requests = labeled = correct = 0
+        latency = LatencyHistogram()
+        for bucket in self.live_buckets(now):
+            requests += bucket.requests
+            labeled += bucket.labeled
+            correct += bucket.correct
+            latency.merge(bucket.latency)
+        return {
+            "window_requests": requests,
+            "window_accuracy": round(correct / labeled * 100, 1) if labeled else None,
+            "window_p95_latency_ms": round(latency.percentile(95), 1),
+        }
+
+
+class _CusumTest:
+    """Repeated SPRT between two Bernoulli rates, clamped at zero."""
+
+    def __init__(self, p_h0, p_h1, boundary):
+        # Log-likelihood ratio contribution of a "bad" / "good" observation
+        self.bad_llr = math.log(p_h1 / p_h0)
+        self.good_llr = math.log((1 - p_h1) / (1 - p_h0))
+        self.boundary = boundary
+
+    def statistic(self, counts):
+        """CUSUM over (bad, good) counts per bucket, oldest first."""
+        statistic = 0.0
+        for bad, good in counts:
+            statistic = max(0.0, statistic + bad * self.bad_llr + good * self.good_llr)
+        return statistic
+
+    def rejected(self, statistic):
+        return statistic >= self.boundary
+
+
+class _VariantState:
+    def __init__(self, evaluator):
+        self.lock = threading.Lock()
+        self.window = SlidingWindow(evaluator.window_seconds, evaluator.window_buckets)
+        threshold = evaluator.accuracy_threshold / 100.0
+        margin = evaluator.accuracy_margin / 100.0
+        # "Bad" accuracy observation = a wrong prediction
+        self.accuracy_test = _CusumTest(1 - min(0.999, threshold + margin),
+                                        1 - max(0.001, threshold - margin),
+                                        evaluator.boundary)
+        self.latency_test = _CusumTest(ACCEPTABLE_SLOW_RATE, UNACCEPTABLE_SLOW_RATE,
+                                       evaluator.boundary)
+
+    def statistics(self, now):
+        """(accuracy statistic, latency statistic) over the window; caller holds the lock."""
+        buckets = self.window.live_buckets(now)
+        return (self.accuracy_test.statistic((b.labeled - b.correct, b.correct) for b in buckets),
+                self.latency_test.statistic((b.slow, b.requests - b.slow) for b in buckets))
+
+
+class RollbackEvaluator:
+    """Background sequential-test evaluator for canary variants."""
+
+    def __init__(self, on_rollback, accuracy_threshold, latency_threshold,
+                 accuracy_margin=5, alpha=0.01, beta=0.05,
+                 window_seconds=60, window_buckets=12, interval_seconds=1.0, feed=None):
+        """
+        on_rollback(variant, reason, message) is called from the evaluator
+        thread. feed(), if given, is called there before every evaluation to
+        pull in observations recorded elsewhere.
+        """
+        self.on_rollback = on_rollback
+        self.feed = feed
+        self.accuracy_threshold = accuracy_threshold
+        self.latency_threshold = latency_threshold
+        self.accuracy_margin = accuracy_margin
+        self.alpha = alpha
+        self.beta = beta
+        self.boundary = math.log((1 - beta) / alpha)
+        self.window_seconds = window_seconds
+        self.window_buckets = window_buckets
+        self.interval_seconds = interval_seconds
+
+        self._variants = {}
+        self._create_lock = threading.Lock()
+        self.failure_started_at = None
+        self.detections = []
+        self._stop = threading.Event()
+
+    def _state(self, variant):
+        state = self._variants.get(variant)
+        if state is None:
+            with self._create_lock:
+                state = self._variants.setdefault(variant, _VariantState(self))
+        return state
+
+    def record(self, variant, correct, latency_ms, now=None):
+        """O(1) update for one canary prediction (correct is None if unlabeled)."""
+        state = self._state(variant)
+        with state.lock:
+            state.window.record(time.time() if now is None else now, correct, latency_ms,
+                                latency_ms > self.latency_threshold)
+
+    def record_counts(self, variant, requests, labeled, correct, latency, now=None):
+        """
+        Batch update for several canary predictions: labeled of the requests
+        had a label, correct of those were right, and latency is a
+        LatencyHistogram of just these requests.
+        """
+        # Buckets whose lower edge is at or above the threshold count as slow
+        slow = sum(count for index, count in enumerate(latency.counts)
+                   if count and index and latency.bucket_upper_bound(index - 1) >= self.latency_threshold)
+        state = self._state(variant)
+        with state.lock:
+            state.window.record_counts(time.time() if now is None else now,
+                                       requests, labeled, correct, slow, latency)
+
+    def reset_variant(self, variant):
+        with self._create_lock:
+            self._variants.pop(variant, None)
+
+    def reset(self):
+        with self._create_lock:
+            self._variants = {}
+        self.failure_started_at = None
+
+    def mark_failure_started(self):
+        """Start the time-to-detect clock (failure simulation switched on)."""
+        self.failure_started_at = time.time()
+
+    def start(self):
+        threading.Thread(target=self._run, name="rollback-evaluator", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            if self.feed is not None:
+                self.feed()
+            self.evaluate()
+
+    def evaluate(self, now=None):
+        """Check every variant's tests; roll back the ones with enough evidence."""
+        now = time.time() if now is None else now
+        for variant, state in list(self._variants.items()):
+            with state.lock:
+                accuracy_statistic, latency_statistic = state.statistics(now)
+                window = state.window.summary(now)
+            accuracy_failed = state.accuracy_test.rejected(accuracy_statistic)
+            latency_failed = state.latency_test.rejected(latency_statistic)
+            if not (accuracy_failed or latency_failed):
+                continue
+
+            if accuracy_failed:
+                reason = "accuracy_below_threshold"
+                message = (f"AUTO ROLLBACK! {variant} accuracy is significantly below "
+                           f"{self.accuracy_threshold}% (window accuracy {window['window_accuracy']}%)")
+            else:
+                reason = "latency_above_threshold"
+                message = (f"AUTO ROLLBACK! {variant} P95 latency is significantly above "
+                           f"{self.latency_threshold}ms (window P95 {window['window_p95_latency_ms']}ms)")
+
+            detection = {"variant": variant, "reason": reason, **window, "at": now}
+            if self.failure_started_at is not None:
+                detection["time_to_detect_seconds"] = round(now - self.failure_started_at, 2)
+            self.detections.append(detection)
+            del self.detections[:-20]  # Keep the most recent detections only
+
+            # Start over so one incident triggers one rollback
+            self.reset_variant(variant)
+            self.on_rollback(variant, reason, message)
+
+    def status(self, variant, now=None):
+        state = self._variants.get(variant)
+        if state is None:
+            return None
+        now = time.time() if now is None else now
+        with state.lock:
+            accuracy_statistic, latency_statistic = state.statistics(now)
+            return {
+                "accuracy_statistic": round(accuracy_statistic, 3),
+                "latency_statistic": round(latency_statistic, 3),
+                **state.window.summary(now),
+            }
+
+    def stats(self):
+        """Return the evaluator fields exposed by /metrics."""
+        return {
+            "boundary": round(self.boundary, 3),
+            "window_seconds": self.window_seconds,
+            "interval_seconds": self.interval_seconds,
+            "variants": {v: self.status(v) for v in list(self._variants)},
+            "detections": self.detections[-5:],
+        }
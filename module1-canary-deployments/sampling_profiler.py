@@ -0,0 +1,113 @@
+"""
+sampling_profiler.py - On-Demand Sampling Profiler
+
+Captures where the router's threads spend their time for a few seconds
+without a debugger or restart. Every interval it reads the current stack
+of every thread (sys._current_frames) and counts identical stacks.
+Threads parked in an idle wait (queue.get, Event.wait, select...) are
+skipped unless asked for, so the result shows the busy hot path.
+
+The cost is one stack walk per thread per sample, and only while a
+profile is running.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Innermost frames that mean "this thread is waiting, not working"
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("socketserver.py", "serve_forever"),
+    ("socket.py", "accept"),
+    ("socket.py", "readinto"),
+}
+
+MAX_SECONDS = 60
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _frame_label(frame):
+    """'app.py:predict:412' for this lab's files, 'flask/app.py:...' for libraries."""
+    code = frame.f_code
+    filename = code.co_filename
+    if os.path.dirname(os.path.abspath(filename)) != HERE:
+        filename = os.path.join(os.path.basename(os.path.dirname(filename)), os.path.basename(filename))
+    else:
+        filename = os.path.basename(filename)
+    return f"{filename}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    """Samples all thread stacks; one profile runs at a time."""
+
+    def __init__(self):
+        self._busy = threading.Lock()
+
+    def profile(self, seconds=5.0, interval_ms=5.0, include_idle=False, top=20):
+        """
+        Sample for `seconds` and return the most common stacks and functions.
+        Raises RuntimeError if another profile is already running.
+        """
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            return self._profile(min(float(seconds), MAX_SECONDS),
+                                 max(float(interval_ms), 1.0) / 1000, include_idle, top)
+        finally:
+            self._busy.release()
+
+    def _profile(self, seconds, interval, include_idle, top):
+        stacks = Counter()
+        inclusive = Counter()
+        leaves = Counter()
+        samples = idle = 0
+        me = threading.get_ident()
+        deadline = time.perf_counter() + seconds
+
+        while time.perf_counter() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                code = frame.f_code
+                if not include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    idle += 1
+                    continue
+
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.reverse()  # Outermost first, like a flame graph
+
+                samples += 1
+                stacks[";".join(labels)] += 1
+                leaves[labels[-1]] += 1
+                for label in set(labels):
+                    inclusive[label] += 1
+            time.sleep(interval)
+
+        def ranked(counter):
+            return [{"frame": key, "samples": count,
+                     "percent": round(count / samples * 100, 1) if samples else 0.0}
+                    for key, count in counter.most_common(top)]
+
+        return {
+            "seconds": seconds,
+            "interval_ms": interval * 1000,
+            "samples": samples,
+            "idle_samples_skipped": idle,
+            "top_self": ranked(leaves),
+            "top_inclusive": ranked(inclusive),
+            "top_stacks": [{"stack": stack, "samples": count} for stack, count in stacks.most_common(top)],
+            # Collapsed format: feed to flamegraph.pl or speedscope
+            "collapsed": [f"{stack} {count}" for stack, count in stacks.most_common()],
+        }
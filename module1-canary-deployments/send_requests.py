@@ -10,14 +10,24 @@ Usage:
   python send_requests.py fail      # Enable failure simulation
   python send_requests.py rollback  # Check rollback trigger
   python send_requests.py reset     # Reset system
+  python send_requests.py load 200 30 # Open-loop load: 200 req/s for 30s
+  python send_requests.py replay traffic.jsonl 10  # Replay a capture at 10x speed
 
 Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
 Lab 1: Canary Deployments for ML Models
 """
 
 import requests
+import json
+import math
+import queue
+import threading
 import time
 import random
+from datetime import datetime
+
+from batch_io import InvalidRecord, iter_records
+from metrics_core import LatencyHistogram
 
 BASE_URL = "http://127.0.0.1:8080"
 
@@ -72,6 +82,296 @@ def send_requests(n=20, delay=0.3):
     show_metrics()
 
 
+# ============================================================
+# OPEN-LOOP LOAD GENERATOR
+# ============================================================
+# Percentiles printed in the latency distribution
+LOAD_PERCENTILES = [50, 75, 90, 95, 99, 99.9, 99.99, 100]
+
+
+def scheduled_offset(i, rps, ramp_seconds):
+    """
+    Seconds after the start at which request i is due. The rate grows
+    linearly from 0 to rps during the ramp, then stays at rps.
+    """
+    ramp_requests = rps * ramp_seconds / 2
+    if i < ramp_requests:
+        return math.sqrt(2 * ramp_seconds * i / rps)
+    return ramp_seconds + (i - ramp_requests) / rps
+
+
+def load_test(rps=100, duration=30, concurrency=32, ramp_seconds=5):
+    """
+    Drive /predict at a target rate on a fixed schedule (open loop).
+
+    Each request is due at its scheduled time whether or not earlier
+    requests have finished. Latency is measured from that scheduled time,
+    so when the server (or this client) falls behind, the waiting time is
+    counted instead of hidden (coordinated-omission correction). Worker
+    threads keep one keep-alive connection each.
+    """
+    ramp_seconds = min(ramp_seconds, duration)
+    total = int(rps * ramp_seconds / 2 + rps * (duration - ramp_seconds))
+    print("\n" + "=" * 60)
+    print(f"Open-loop load: {rps} req/s for {duration}s "
+          f"(ramp {ramp_seconds}s, {concurrency} connections, {total} requests)")
+    print("=" * 60 + "\n")
+
+    lock = threading.Lock()
+    next_index = [0]
+    results = {}  # model_version -> {"latency", "service", "requests", "correct"}
+    errors = {}
+    late = [0]
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next_index[0]
+                next_index[0] += 1
+            if i >= total:
+                break
+
+            due = start + scheduled_offset(i, rps, ramp_seconds)
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            sample = random.choice(TEST_DATA)
+            sent = time.perf_counter()
+            try:
+                response = session.post(f"{BASE_URL}/predict",
+                                        json={**sample, "user_id": f"load-{i % 1000}"}, timeout=30)
+                done = time.perf_counter()
+                response.raise_for_status()
+                result = response.json()
+            except Exception as e:
+                key = getattr(getattr(e, "response", None), "status_code", None) or type(e).__name__
+                with lock:
+                    errors[key] = errors.get(key, 0) + 1
+                continue
+
+            with lock:
+                if wait < 0:
+                    late[0] += 1
+                r = results.setdefault(result['model_version'], new_version_result())
+                r["latency"].record((done - due) * 1000)     # Corrected: from scheduled time
+                r["service"].record((done - sent) * 1000)    # Uncorrected: from actual send
+                r["requests"] += 1
+                r["labeled"] += 1
+                r["correct"] += int(result['prediction'] == sample['actual_label'])
+
+    start = time.perf_counter() + 0.1
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    print_load_report(results, errors, late[0], total, elapsed)
+
+
+def new_version_result():
+    """Per-model_version tallies used by the load and replay reports."""
+    return {"latency": LatencyHistogram(), "service": LatencyHistogram(),
+            "requests": 0, "labeled": 0, "correct": 0}
+
+
+def print_load_report(results, errors, late, total, elapsed):
+    completed = sum(r["requests"] for r in results.values())
+    print(f"  Completed: {completed}/{total} in {elapsed:.1f}s "
+          f"-> {completed / elapsed:.1f} req/s achieved")
+    if late:
+        print(f"  Sent late: {late} requests started after their scheduled time "
+              f"(raise concurrency if this is large)")
+    if errors:
+        print(f"  Errors: {errors}")
+    print_version_latency(results)
+
+
+def print_version_latency(results):
+    """Accuracy and latency percentile distribution per model_version."""
+    for version in sorted(results):
+        r = results[version]
+        latency, service = r["latency"], r["service"]
+        accuracy = f"{r['correct'] / r['labeled'] * 100:.1f}%" if r["labeled"] else "n/a (no labels)"
+        print("\n" + "-" * 60)
+        print(f"  {version}: {r['requests']} requests, accuracy {accuracy}")
+        print("-" * 60)
+        print(f"  {'Percentile':>10} {'Latency':>12} {'Service time':>14}")
+        for pct in LOAD_PERCENTILES:
+            print(f"  {pct:>9}% {latency.percentile(pct):>10.1f}ms {service.percentile(pct):>12.1f}ms")
+        print(f"  {'mean':>10} {latency.mean():>10.1f}ms {service.mean():>12.1f}ms")
+    print("\n  Latency = from scheduled send time (coordinated-omission corrected)")
+    print("  Service time = from actual send time\n")
+
+
+# ============================================================
+# TRAFFIC REPLAY
+# ============================================================
+# Captures are JSONL (or a JSON array) of /predict bodies, optionally with
+# the original arrival time:
+#   {"timestamp": 1718000000.25, "text": "...", "actual_label": 1, "user_id": "u42"}
+# "timestamp" is epoch seconds or an ISO 8601 string.
+
+
+def record_timestamp(record):
+    """Arrival time of a captured record in epoch seconds, or None."""
+    value = record.get("timestamp")
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def iter_paced(path, speed):
+    """
+    Stream (record, due) pairs from a capture without loading it, one
+    record at a time; replay() groups them into chunks for the batch
+    endpoint. `due` is when the record should be sent, preserving the
+    original gaps divided by `speed` (speed 0 = as fast as possible).
+    Unparseable records come through as (None, None).
+    """
+    first_timestamp = None
+    start = time.perf_counter()
+    with open(path, "rb") as stream:
+        for record in iter_records(stream):
+            if isinstance(record, InvalidRecord) or not isinstance(record, dict):
+                yield None, None
+                continue
+            timestamp = record_timestamp(record)
+            due = time.perf_counter()
+            if speed > 0 and timestamp is not None:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                due = start + (timestamp - first_timestamp) / speed
+            yield record, due
+
+
+def replay(path, speed=1.0, concurrency=16, batch_size=0):
+    """
+    Replay a captured traffic file against /predict (or /predict_batch in
+    chunks of batch_size) with the original timing scaled by `speed`.
+    Memory stays flat: the file is streamed and at most a few requests per
+    worker are queued.
+    """
+    mode = f"/predict_batch in chunks of {batch_size}" if batch_size else "/predict"
+    pace = f"{speed}x speed" if speed > 0 else "as fast as possible"
+    print("\n" + "=" * 60)
+    print(f"Replaying {path} -> {mode} ({pace}, {concurrency} workers)")
+    print("=" * 60 + "\n")
+
+    work = queue.Queue(maxsize=concurrency * 4)
+    lock = threading.Lock()
+    results = {}
+    errors = {}
+    counts = {"sent": 0, "invalid": 0, "late": 0}
+
+    def tally(version, latency_ms, service_ms, prediction, actual_label):
+        r = results.setdefault(version, new_version_result())
+        r["latency"].record(latency_ms)
+        r["service"].record(service_ms)
+        r["requests"] += 1
+        if actual_label is not None:
+            r["labeled"] += 1
+            r["correct"] += int(prediction == actual_label)
+
+    def send_one(session, records, due):
+        sent = time.perf_counter()
+        if batch_size:
+            body = "\n".join(json.dumps(r) for r in records)
+            response = session.post(f"{BASE_URL}/predict_batch", data=body, stream=True, timeout=60,
+                                    headers={"Content-Type": "application/x-ndjson"})
+            response.raise_for_status()
+            lines = [json.loads(line) for line in response.iter_lines() if line]
+        else:
+            response = session.post(f"{BASE_URL}/predict", json=records[0], timeout=30)
+            response.raise_for_status()
+            lines = [response.json()]
+        done = time.perf_counter()
+
+        with lock:
+            for offset, result in enumerate(lines):
+                if "error" in result:
+                    errors["invalid row"] = errors.get("invalid row", 0) + 1
+                    continue
+                record = records[result.get("index", offset)]
+                tally(result["model_version"], (done - due) * 1000, (done - sent) * 1000,
+                      result["prediction"], record.get("actual_label"))
+
+    def worker():
+        session = requests.Session()
+        while True:
+            item = work.get()
+            if item is None:
+                break
+            records, due = item
+            try:
+                send_one(session, records, due)
+            except Exception as e:
+                key = getattr(getattr(e, "response", None), "status_code", None) or type(e).__name__
+                with lock:
+                    errors[key] = errors.get(key, 0) + len(records)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+
+    start = time.perf_counter()
+    pending, pending_due = [], None
+    for record, due in iter_paced(path, speed):
+        if record is None:
+            counts["invalid"] += 1
+            continue
+        wait = due - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        elif wait < -0.01:
+            counts["late"] += 1
+        if pending_due is None:
+            pending_due = due
+        pending.append(record)
+        if len(pending) >= max(1, batch_size):
+            work.put((pending, pending_due))  # Blocks when workers fall behind
+            counts["sent"] += len(pending)
+            pending, pending_due = [], None
+    if pending:
+        work.put((pending, pending_due))
+        counts["sent"] += len(pending)
+    for _ in threads:
+        work.put(None)
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    completed = sum(r["requests"] for r in results.values())
+    print(f"  Replayed: {completed}/{counts['sent']} records in {elapsed:.1f}s "
+          f"-> {completed / elapsed:.1f} records/s")
+    if counts["invalid"]:
+        print(f"  Skipped: {counts['invalid']} unparseable lines")
+    if counts["late"]:
+        print(f"  Sent late: {counts['late']} records (raise concurrency or lower the speed)")
+    if errors:
+        print(f"  Errors: {errors}")
+    print_version_latency(results)
+
+
+def write_capture(path, n=1000, rps=20.0):
+    """Write a synthetic capture (TEST_DATA with Poisson arrival times) for replay."""
+    timestamp = time.time()
+    with open(path, "w") as f:
+        for i in range(n):
+            timestamp += random.expovariate(rps)
+            sample = random.choice(TEST_DATA)
+            f.write(json.dumps({"timestamp": round(timestamp, 6), **sample,
+                                "user_id": f"user-{random.randrange(500)}"}) + "\n")
+    print(f"\nWrote {n} records (~{rps} req/s) to {path}\n")
+
+
 def show_metrics():
     """Display current metrics."""
     try:
@@ -83,15 +383,18 @@ def show_metrics():
         print("=" * 60)
         print(f"\n  Canary Traffic: {metrics['canary_percentage']}%")
         print()
-        print("  +-------------+----------+----------+-------------+")
-        print("  |   Model     | Requests | Accuracy | Avg Latency |")
-        print("  +-------------+----------+----------+-------------+")
+        print("  +-------------+----------+----------+-------------+-------------+")
+        print("  |   Model     | Requests | Accuracy | Avg Latency | P95 Latency |")
+        print("  +-------------+----------+----------+-------------+-------------+")
 
-        for version in ["production", "canary"]:
+        for version in ["production", "canary", "shadow"]:
+            if version not in metrics:
+                continue
             m = metrics[version]
-            print(f"  | {version:11} | {m['requests']:>8} | {m['accuracy']:>7.1f}% | {m['avg_latency_ms']:>9.1f}ms |")
+            print(f"  | {version:11} | {m['requests']:>8} | {m['accuracy']:>7.1f}% "
+                  f"| {m['avg_latency_ms']:>9.1f}ms | {m['p95_latency_ms']:>9.1f}ms |")
 
-        print("  +-------------+----------+----------+-------------+")
+        print("  +-------------+----------+----------+-------------+-------------+")
         print()
 
     except Exception as e:
@@ -107,7 +410,10 @@ def check_rollback():
         if result['status'] == 'rollback':
             print("\n" + "!" * 60)
             print("  ROLLBACK TRIGGERED!")
-            print(f"  Reason: Canary accuracy {result['canary_accuracy']}% < {result['threshold']}%")
+            if result['reason'] == 'latency_above_threshold':
+                print(f"  Reason: Canary P95 latency {result['canary_p95_latency_ms']}ms > {result['threshold']}ms")
+            else:
+                print(f"  Reason: Canary accuracy {result['canary_accuracy']}% < {result['threshold']}%")
             print("!" * 60 + "\n")
         elif result['status'] == 'waiting':
             print(f"\n  Waiting for more data: {result['message']}\n")
@@ -146,6 +452,15 @@ def disable_failure():
         print(f"ERROR: {e}")
 
 
+def set_shadow(enable):
+    """Enable or disable shadow mode (canary scores copies, production answers)."""
+    try:
+        requests.post(f"{BASE_URL}/shadow/{1 if enable else 0}")
+        print(f"\nShadow mode {'ENABLED' if enable else 'DISABLED'}\n")
+    except Exception as e:
+        print(f"ERROR: {e}")
+
+
 def reset():
     """Reset all metrics and settings."""
     try:
@@ -167,14 +482,24 @@ Usage:
   python send_requests.py canary <n>  Set canary percentage to n%
   python send_requests.py fail        Enable failure simulation
   python send_requests.py nofail      Disable failure simulation
+  python send_requests.py shadow      Enable shadow mode (canary never answers users)
+  python send_requests.py noshadow    Disable shadow mode
   python send_requests.py rollback    Check if rollback should trigger
   python send_requests.py reset       Reset all metrics and settings
+  python send_requests.py load <rps> [seconds] [concurrency] [ramp]
+                                      Open-loop load test (defaults: 30s, 32, 5s ramp)
+  python send_requests.py replay <file.jsonl> [speed] [concurrency] [batch]
+                                      Replay captured traffic (defaults: 1x, 16, no batching;
+                                      speed 0 = as fast as possible)
+  python send_requests.py capture <file.jsonl> [n] [rps]
+                                      Write a synthetic capture to replay
 
 Examples:
   python send_requests.py send 50     # Send 50 test requests
   python send_requests.py canary 10   # Set 10% traffic to canary
   python send_requests.py fail        # Make canary produce bad predictions
   python send_requests.py rollback    # Trigger rollback check
+  python send_requests.py load 200 60 # 200 req/s for a minute
     """)
 
 
@@ -199,8 +524,35 @@ if __name__ == "__main__":
             enable_failure()
         elif cmd == "nofail":
             disable_failure()
+        elif cmd == "shadow":
+            set_shadow(True)
+        elif cmd == "noshadow":
+            set_shadow(False)
         elif cmd == "reset":
             reset()
+        elif cmd == "load":
+            if len(sys.argv) > 2:
+                load_test(rps=float(sys.argv[2]),
+                          duration=float(sys.argv[3]) if len(sys.argv) > 3 else 30,
+                          concurrency=int(sys.argv[4]) if len(sys.argv) > 4 else 32,
+                          ramp_seconds=float(sys.argv[5]) if len(sys.argv) > 5 else 5)
+            else:
+                print("Usage: python send_requests.py load <rps> [seconds] [concurrency] [ramp]")
+        elif cmd == "replay":
+            if len(sys.argv) > 2:
+                replay(sys.argv[2],
+                       speed=float(sys.argv[3]) if len(sys.argv) > 3 else 1.0,
+                       concurrency=int(sys.argv[4]) if len(sys.argv) > 4 else 16,
+                       batch_size=int(sys.argv[5]) if len(sys.argv) > 5 else 0)
+            else:
+                print("Usage: python send_requests.py replay <file.jsonl> [speed] [concurrency] [batch]")
+        elif cmd == "capture":
+            if len(sys.argv) > 2:
+                write_capture(sys.argv[2],
+                              n=int(sys.argv[3]) if len(sys.argv) > 3 else 1000,
+                              rps=float(sys.argv[4]) if len(sys.argv) > 4 else 20.0)
+            else:
+                print("Usage: python send_requests.py capture <file.jsonl> [n] [rps]")
         else:
             print(f"Unknown command: {cmd}")
             print_usage()
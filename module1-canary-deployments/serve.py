@@ -0,0 +1,90 @@
+"""
+serve.py - Multi-Worker Canary Router
+
+Runs app.py in several pre-forked worker processes so the router can use
+every CPU core. The launcher binds the listening socket and creates the
+shared-memory region (shared_state.py) before forking; every worker loads
+its own models and accepts connections from the same socket.
+
+Metrics, routing weights and the failure-simulation / shadow flags are
+shared, so /metrics, /check_rollback, /set_canary, /set_weights and the
+other control endpoints behave the same whichever worker answers.
+Worker 0 also runs the automatic rollback evaluator for all of them.
+
+Usage:
+  python serve.py             # One worker per CPU core
+  WORKERS=4 python serve.py
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import os
+import signal
+import socket
+import sys
+
+from shared_state import SharedRegion, attach_worker
+
+WORKERS = int(os.environ.get('WORKERS', str(os.cpu_count() or 1)))
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', '8080'))
+
+
+def run_worker(region, worker_index, listener):
+    """Body of one forked worker process. Never returns."""
+    attach_worker(region, worker_index)
+    from werkzeug.serving import make_server
+
+    import app  # Loads this worker's models; sees the shared region
+
+    server = make_server(HOST, PORT, app.app, threaded=True, fd=listener.fileno())
+    print(f"Worker {worker_index} (pid {os.getpid()}) serving")
+    server.serve_forever()
+
+
+def main():
+    region = SharedRegion(WORKERS)
+    listener = socket.create_server((HOST, PORT), backlog=128)
+    listener.set_inheritable(True)
+
+    print("\n" + "=" * 60)
+    print("CANARY DEPLOYMENT LAB SERVER (multi-worker)")
+    print("=" * 60)
+    print(f"Workers: {WORKERS}")
+    print(f"Listening on: http://{HOST}:{PORT}")
+    print(f"Shared memory: {region.shm.name} ({region.size / 1024:.0f} KB)")
+    print("=" * 60 + "\n")
+
+    children = []
+    for worker_index in range(WORKERS):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                run_worker(region, worker_index, listener)
+            finally:
+                os._exit(1)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # Wait for every worker, then remove the shared-memory block
+    for pid in children:
+        os.waitpid(pid, 0)
+    listener.close()
+    region.close(unlink=True)
+    print("\nAll workers stopped")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
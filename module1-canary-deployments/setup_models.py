@@ -7,17 +7,37 @@ This script creates and registers two model versions in MLflow:
 
 Run this script ONCE before starting the lab exercises.
 
+For real retraining corpora that do not fit in memory, `train-corpus`
+streams a CSV or JSONL file in chunks and registers the result as a new
+version of the same model, without a stage (see STREAMING TRAINING below).
+Given a labeled evaluation dataset it then runs the offline gate from
+evaluate_candidate.py, which is the only way the new version reaches
+Staging:
+
+  python setup_models.py                                           # Lab setup (v1 + v2)
+  python setup_models.py train-corpus reviews.jsonl                # Register only
+  python setup_models.py train-corpus reviews.jsonl holdout.jsonl  # Register, Staging if it passes
+
 Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
 Lab 1: Canary Deployments for ML Models
 """
 
+import os
+import sys
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import mlflow
 from mlflow.tracking import MlflowClient
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.pipeline import Pipeline
 import numpy as np
 
+from batch_io import iter_chunks, iter_labeled_rows
+
 # Connect to MLflow server
 mlflow.set_tracking_uri("http://127.0.0.1:5001")
 mlflow.set_experiment("sentiment-classifier")
@@ -116,5 +136,155 @@ def setup_model_registry():
     print("=" * 50)
 
 
+# ============================================================
+# STREAMING TRAINING (large corpora)
+# ============================================================
+# Memory stays bounded by CHUNK_SIZE x (workers x 2) rows whatever the
+# corpus size: the corpus is read lazily, the hashing vectorizer keeps no
+# vocabulary, and the classifier learns one chunk at a time (partial_fit).
+# The held-out split is chosen by hashing each text, so every pass sees the
+# same split and duplicate texts never land on both sides.
+MODEL_NAME = "sentiment"
+CLASSES = np.array([0, 1])
+
+CHUNK_SIZE = int(os.environ.get('TRAIN_CHUNK_SIZE', '10000'))             # Rows per partial_fit
+TRAIN_WORKERS = int(os.environ.get('TRAIN_WORKERS', str(os.cpu_count() or 1)))  # Vectorizer processes
+TRAIN_EPOCHS = int(os.environ.get('TRAIN_EPOCHS', '2'))                   # Passes over the corpus
+HOLDOUT_PERCENT = int(os.environ.get('TRAIN_HOLDOUT_PERCENT', '10'))      # Rows kept for evaluation
+HASH_FEATURES = 2 ** int(os.environ.get('TRAIN_HASH_BITS', '20'))         # Hashed feature columns
+
+
+def is_held_out(text):
+    return zlib.crc32(text.encode("utf-8")) % 100 < HOLDOUT_PERCENT
+
+
+def iter_split(path, held_out, stats):
+    """Valid rows of one side of the split; malformed rows are counted and skipped."""
+    for text, label in iter_labeled_rows(path, stats):
+        if is_held_out(text) == held_out:
+            yield text, label
+
+
+def iter_vectorized(vectorizer, rows, pool):
+    """
+    Yield (X, y) per chunk of rows. With a process pool, up to two chunks per
+    worker are vectorized ahead of the learner; results keep corpus order.
+    """
+    chunks = ((list(texts), np.array(labels, dtype=np.int8))
+              for texts, labels in (zip(*chunk) for chunk in iter_chunks(rows, CHUNK_SIZE)))
+    if pool is None:
+        for texts, labels in chunks:
+            yield vectorizer.transform(texts), labels
+        return
+
+    pending = deque()
+    for texts, labels in chunks:
+        pending.append((pool.submit(vectorizer.transform, texts), labels))
+        if len(pending) >= TRAIN_WORKERS * 2:
+            future, labels = pending.popleft()
+            yield future.result(), labels
+    while pending:
+        future, labels = pending.popleft()
+        yield future.result(), labels
+
+
+def evaluate_streaming(model, vectorizer, path, pool, stats):
+    """Score the held-out split in vectorized batches; only counts are kept."""
+    tp = tn = fp = fn = 0
+    for X, y in iter_vectorized(vectorizer, iter_split(path, True, stats), pool):
+        predictions = model.predict(X)
+        tp += int(np.sum((predictions == 1) & (y == 1)))
+        tn += int(np.sum((predictions == 0) & (y == 0)))
+        fp += int(np.sum((predictions == 1) & (y == 0)))
+        fn += int(np.sum((predictions == 0) & (y == 1)))
+
+    total = tp + tn + fp + fn
+    return {
+        "heldout_rows": total,
+        "heldout_accuracy": (tp + tn) / total if total else 0.0,
+        "heldout_precision": tp / (tp + fp) if tp + fp else 0.0,
+        "heldout_recall": tp / (tp + fn) if tp + fn else 0.0,
+    }
+
+
+def train_from_corpus(path, run_name=None):
+    """
+    Train a hashing + SGD sentiment model on a corpus file, evaluate it on
+    the held-out split and register it as a new `sentiment` version with no
+    stage. Returns the registered version number.
+    """
+    vectorizer = HashingVectorizer(n_features=HASH_FEATURES, ngram_range=(1, 2),
+                                   alternate_sign=False, norm="l2")
+    clf = SGDClassifier(loss="log_loss", alpha=1e-5, random_state=42)
+    rng = np.random.default_rng(42)
+    run_name = run_name or f"corpus-{os.path.basename(path)}"
+
+    print(f"\nStreaming training on {path}")
+    print(f"  chunk={CHUNK_SIZE} rows, workers={TRAIN_WORKERS}, epochs={TRAIN_EPOCHS}, "
+          f"held-out={HOLDOUT_PERCENT}%, features={HASH_FEATURES}")
+    print("-" * 50)
+
+    pool = ProcessPoolExecutor(max_workers=TRAIN_WORKERS) if TRAIN_WORKERS > 1 else None
+    try:
+        with mlflow.start_run(run_name=run_name):
+            mlflow.log_param("model_type", "SGDClassifier(log_loss)")
+            mlflow.log_param("vectorizer", f"HashingVectorizer({HASH_FEATURES}, ngrams 1-2)")
+            mlflow.log_param("version", run_name)
+            mlflow.log_param("corpus", os.path.abspath(path))
+            mlflow.log_param("epochs", TRAIN_EPOCHS)
+            mlflow.log_param("chunk_size", CHUNK_SIZE)
+            mlflow.log_param("holdout_percent", HOLDOUT_PERCENT)
+
+            start = time.time()
+            stats = {"skipped": 0}
+            trained_rows = 0
+            for epoch in range(1, TRAIN_EPOCHS + 1):
+                stats["skipped"] = 0
+                trained_rows = 0
+                for X, y in iter_vectorized(vectorizer, iter_split(path, False, stats), pool):
+                    order = rng.permutation(len(y))  # Breaks up runs of one label in sorted corpora
+                    clf.partial_fit(X[order], y[order], classes=CLASSES)
+                    trained_rows += len(y)
+                print(f"  Epoch {epoch}: {trained_rows} rows ({time.time() - start:.1f}s)")
+            if trained_rows == 0:
+                raise ValueError(f"No usable training rows in {path}")
+
+            metrics = evaluate_streaming(clf, vectorizer, path, pool, {"skipped": 0})
+            mlflow.log_metric("training_rows", trained_rows)
+            mlflow.log_metric("skipped_rows", stats["skipped"])
+            mlflow.log_metric("training_seconds", time.time() - start)
+            for key, value in metrics.items():
+                mlflow.log_metric(key, value)
+            print(f"  Held-out accuracy: {metrics['heldout_accuracy']:.2%} "
+                  f"on {metrics['heldout_rows']} rows ({stats['skipped']} rows skipped)")
+
+            # Same input contract as the lab models: a pipeline over raw texts
+            model = Pipeline([('hashing', vectorizer), ('clf', clf)])
+            model_info = mlflow.sklearn.log_model(
+                model,
+                artifact_path="model",
+                registered_model_name=MODEL_NAME
+            )
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    version = model_info.registered_model_version
+    print(f"Registered {MODEL_NAME} version {version} (no stage)")
+    return version
+
+
 if __name__ == "__main__":
-    setup_model_registry()
+    if len(sys.argv) > 1 and sys.argv[1] == "train-corpus":
+        if len(sys.argv) < 3:
+            print("Usage: python setup_models.py train-corpus <corpus.csv|.jsonl> [eval_dataset]")
+            sys.exit(1)
+        version = train_from_corpus(sys.argv[2])
+        if len(sys.argv) > 3:
+            import evaluate_candidate
+
+            # Moves the version to Staging only if it passes every budget
+            sys.exit(0 if evaluate_candidate.gate(sys.argv[3], version) else 1)
+        print(f"To promote it: python evaluate_candidate.py <eval_dataset> {version}")
+    else:
+        setup_model_registry()
@@ -0,0 +1,69 @@
+"""
+shadow.py - Asynchronous Shadow Traffic for the Canary
+
+In shadow mode production answers every request. A copy of each request is
+handed to a small pool of background workers that score it with the canary
+and record the result under separate "shadow" metrics. The user never waits
+for the canary.
+
+The hand-off never blocks: work goes into a bounded queue, and when the
+queue is full the copy is dropped and counted instead.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import queue
+import threading
+
+
+class ShadowScorer:
+    """Bounded background worker pool that drops work when saturated."""
+
+    def __init__(self, score_fn, workers=2, queue_size=1000):
+        """score_fn(text, actual_label) is called on a worker thread."""
+        self.score_fn = score_fn
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self.reset_stats()
+
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f"shadow-{i}", daemon=True).start()
+
+    def reset_stats(self):
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.errors = 0
+
+    def submit(self, text, actual_label=None):
+        """Queue a copy of a request for the canary. Returns False if dropped."""
+        try:
+            self._queue.put_nowait((text, actual_label))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def _run(self):
+        while True:
+            text, actual_label = self._queue.get()
+            try:
+                self.score_fn(text, actual_label)
+                self.completed += 1
+            except Exception:
+                self.errors += 1
+
+    def stats(self):
+        """Return the shadow fields exposed by /metrics."""
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queue_depth": self._queue.qsize(),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "completed": self.completed,
+            "errors": self.errors,
+        }
@@ -0,0 +1,368 @@
+"""
+shared_state.py - Shared-Memory Metrics and Routing Weights for Pre-Fork Workers
+
+With several worker processes (see serve.py) each process would otherwise
+have its own metrics and its own routing weights, so /metrics and
+/check_rollback would only see one worker's traffic and /set_canary would
+only change one worker.
+
+SharedRegion is one multiprocessing.shared_memory block created by the
+launcher before it forks, laid out as numpy arrays:
+
+  header           reset generation, weights sequence number, control flags
+  variant table    up to MAX_VARIANTS (name, weight) pairs
+  series table     up to MAX_SERIES (name, epoch, model version) entries
+  rows             one row per (worker, thread row, series): counters,
+                   latency histogram buckets, latency sum and max
+
+Each request thread leases one of its worker's WORKER_METRIC_ROWS thread
+rows and is its only writer, so neither workers nor threads contend; a
+thread's row goes back to the pool when it exits. Threads beyond that many
+at once share one overflow row under a lock. Readers sum every row. Routing weights are published
+with a sequence lock (odd = write in progress) and every worker rebuilds
+its local RoutingTable when the sequence number changes, so route() stays
+a single integer comparison on the hot path.
+
+SharedMetricsStore, SharedWeightedRouter and SharedFlags have the same
+interface as MetricsStore, WeightedRouter and a plain dict, so app.py uses
+them without further changes when it runs inside a worker.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from metrics_core import LatencyHistogram
+from traffic_router import RoutingTable, WeightedRouter
+
+MAX_VARIANTS = 8
+MAX_SERIES = 16
+NAME_BYTES = 32
+METRIC_FIELDS = ("requests", "correct", "labeled")
+FLAG_NAMES = ("simulate_failure", "shadow_mode")
+WORKER_METRIC_ROWS = int(os.environ.get('WORKER_METRIC_ROWS', '16'))  # Lock-free thread rows per worker
+
+# Header slots
+_GENERATION = 0      # Bumped by reset(); rows from older generations are ignored
+_WEIGHTS_SEQ = 1     # Odd while the variant table is being rewritten
+_WEIGHTS_SET = 2     # 1 once the first worker has published its weights
+_FLAGS_SET = 3       # 1 once the first worker has published its flag defaults
+_FLAGS = 4
+_FLAGS_ON_MS = _FLAGS + len(FLAG_NAMES)  # When each flag was last switched on (ms since epoch)
+_HEADER_SLOTS = _FLAGS_ON_MS + len(FLAG_NAMES)
+
+# Row layout (int64): generation, series epoch, latency count, fields, buckets
+_ROW_GENERATION = 0
+_ROW_EPOCH = 1
+_ROW_COUNT = 2
+_ROW_FIELDS = 3
+_ROW_BUCKETS = _ROW_FIELDS + len(METRIC_FIELDS)
+
+# Only used for its bucket layout
+_LAYOUT = LatencyHistogram()
+
+# Region this process serves from; set by serve.py in each forked worker
+_worker_region = None
+
+
+class SharedRegion:
+    """Shared-memory block for all workers. Create it before forking."""
+
+    def __init__(self, workers):
+        self.workers = max(1, int(workers))
+        self.worker_index = 0
+        self.thread_rows = max(1, WORKER_METRIC_ROWS)  # Plus one overflow row
+        row_length = _ROW_BUCKETS + len(_LAYOUT.counts)
+        layout = [
+            ("header", np.int64, (_HEADER_SLOTS,)),
+            ("variant_names", f"S{NAME_BYTES}", (MAX_VARIANTS,)),
+            ("variant_weights", np.int64, (MAX_VARIANTS,)),
+            ("series_names", f"S{NAME_BYTES}", (MAX_SERIES,)),
+            ("series_epochs", np.int64, (MAX_SERIES,)),
+            ("series_versions", f"S{NAME_BYTES}", (MAX_SERIES,)),  # Model version of the last reset
+            ("rows", np.int64, (self.workers, self.thread_rows + 1, MAX_SERIES, row_length)),
+            ("row_times", np.float64, (self.workers, self.thread_rows + 1, MAX_SERIES, 2)),  # latency sum, max
+        ]
+        size = sum(np.dtype(dtype).itemsize * int(np.prod(shape)) for _, dtype, shape in layout)
+
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.shm.buf[:size] = bytes(size)
+        self._arrays = [name for name, _, _ in layout]
+        offset = 0
+        for name, dtype, shape in layout:
+            array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            setattr(self, name, array)
+            offset += array.nbytes
+
+        self.lock = multiprocessing.Lock()  # Serializes writers of shared tables
+        self._series_slots = {}             # Process-local name -> slot cache
+
+    @property
+    def size(self):
+        return self.shm.size
+
+    def series_slot(self, series):
+        """Slot of a series in the series table, claiming a free one if new."""
+        slot = self._series_slots.get(series)
+        if slot is not None:
+            return slot
+
+        encoded = _encode_name(series)
+        with self.lock:
+            for slot in range(MAX_SERIES):
+                name = self.series_names[slot]
+                if name == encoded:
+                    break
+                if not name:
+                    self.series_names[slot] = encoded
+                    break
+            else:
+                raise ValueError(f"Shared metrics support at most {MAX_SERIES} series")
+        self._series_slots[series] = slot
+        return slot
+
+    def close(self, unlink=False):
+        """Release this process's mapping; the launcher also unlinks the block."""
+        for name in self._arrays:
+            setattr(self, name, None)
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _encode_name(name):
+    encoded = str(name).encode()
+    if len(encoded) > NAME_BYTES:
+        raise ValueError(f"Name {name!r} is longer than {NAME_BYTES} bytes")
+    return encoded
+
+
+def attach_worker(region, worker_index):
+    """Called in a forked worker before app.py is imported."""
+    global _worker_region
+    region.worker_index = worker_index
+    _worker_region = region
+
+
+def worker_region():
+    """The SharedRegion of this worker process, or None when single-process."""
+    return _worker_region
+
+
+class _RowLease:
+    """Kept in a thread's local storage; returns its row to the pool when the thread exits."""
+
+    __slots__ = ("index", "free")
+
+    def __init__(self, index, free):
+        self.index = index
+        self.free = free
+
+    def __del__(self):
+        self.free.append(self.index)
+
+
+class SharedMetricsStore:
+    """MetricsStore interface backed by a SharedRegion."""
+
+    def __init__(self, region):
+        self.region = region
+        self._local = threading.local()
+        self._free = list(range(region.thread_rows))  # Thread rows no live thread holds
+        self._overflow_lock = threading.Lock()        # Only for threads that found none free
+
+    def _thread_row(self):
+        """This thread's row index, or None if every row is taken."""
+        lease = getattr(self._local, "lease", None)
+        if lease is None:
+            # list.pop and list.append are atomic, so no lock is needed
+            try:
+                index = self._free.pop()
+            except IndexError:
+                return None  # Try again on the next write
+            lease = self._local.lease = _RowLease(index, self._free)
+        return lease.index
+
+    def record(self, series, latency_ms=None, **counts):
+        """Add counts and optionally one latency to this thread's row."""
+        slot = self.region.series_slot(series)
+        index = self._thread_row()
+        if index is not None:
+            self._add(index, slot, latency_ms, counts)
+        else:
+            with self._overflow_lock:
+                self._add(self.region.thread_rows, slot, latency_ms, counts)
+
+    def _add(self, index, slot, latency_ms, counts):
+        region = self.region
+        row = region.rows[region.worker_index, index, slot]
+        times = region.row_times[region.worker_index, index, slot]
+
+        generation = region.header[_GENERATION]
+        epoch = region.series_epochs[slot]
+        if row[_ROW_GENERATION] != generation or row[_ROW_EPOCH] != epoch:
+            # First write since a reset: start this row over
+            row.fill(0)
+            times.fill(0)
+            row[_ROW_GENERATION] = generation
+            row[_ROW_EPOCH] = epoch
+
+        for field, amount in counts.items():
+            row[_ROW_FIELDS + METRIC_FIELDS.index(field)] += amount
+        if latency_ms is not None:
+            row[_ROW_BUCKETS + _LAYOUT._bucket_index(latency_ms)] += 1
+            row[_ROW_COUNT] += 1
+            times[0] += latency_ms
+            if latency_ms > times[1]:
+                times[1] = latency_ms
+
+    def inc(self, series, field, amount=1):
+        self.record(series, **{field: amount})
+
+    @property
+    def generation(self):
+        """Bumped by every reset(), whichever worker made it."""
+        return int(self.region.header[_GENERATION])
+
+    def snapshot(self):
+        """Sum every row of every worker into {series: {"counters", "latency"}}."""
+        region = self.region
+        generation = region.header[_GENERATION]
+        result = {}
+        for slot in range(MAX_SERIES):
+            name = region.series_names[slot]
+            if not name:
+                continue
+            rows = region.rows[:, :, slot].reshape(-1, region.rows.shape[-1])
+            live = ((rows[:, _ROW_GENERATION] == generation)
+                    & (rows[:, _ROW_EPOCH] == region.series_epochs[slot]))
+            if not live.any():
+                continue
+
+            merged = rows[live].sum(axis=0)
+            times = region.row_times[:, :, slot].reshape(-1, 2)[live]
+            histogram = LatencyHistogram()
+            histogram.counts = merged[_ROW_BUCKETS:].tolist()
+            histogram.count = int(merged[_ROW_COUNT])
+            histogram.total_ms = float(times[:, 0].sum())
+            histogram.max_seen_ms = float(times[:, 1].max())
+            result[name.decode()] = {
+                "counters": {field: int(merged[_ROW_FIELDS + i])
+                             for i, field in enumerate(METRIC_FIELDS)},
+                "latency": histogram,
+            }
+        return result
+
+    def series(self, series):
+        return self.snapshot().get(series, {"counters": {}, "latency": LatencyHistogram()})
+
+    def reset(self):
+        """Start over in every worker."""
+        with self.region.lock:
+            self.region.header[_GENERATION] += 1
+
+    def reset_series(self, series, version=None):
+        """
+        Start one series over in every worker. Every worker hot-reloads the
+        same new model on its own, so with a version only the first call for
+        it resets the series.
+        """
+        region = self.region
+        slot = region.series_slot(series)
+        with region.lock:
+            if version is not None:
+                encoded = _encode_name(version)
+                if region.series_versions[slot] == encoded:
+                    return
+                region.series_versions[slot] = encoded
+            region.series_epochs[slot] += 1
+
+
+class SharedWeightedRouter(WeightedRouter):
+    """
+    WeightedRouter whose weights live in a SharedRegion. Writers hold the
+    region lock; readers use a cached RoutingTable until the shared
+    sequence number changes.
+    """
+
+    def __init__(self, region, weights, default_variant="production"):
+        self.region = region
+        self.default_variant = default_variant
+        self._write_lock = region.lock
+        with region.lock:
+            if not region.header[_WEIGHTS_SET]:
+                # First worker up publishes the initial weights
+                self._table = RoutingTable(self._validate(weights), default_variant)
+                region.header[_WEIGHTS_SET] = 1
+            else:
+                self._local_table = RoutingTable(self._read_weights(), default_variant)
+                self._local_seq = int(region.header[_WEIGHTS_SEQ])
+
+    def _read_weights(self):
+        region = self.region
+        return {name.decode(): int(weight)
+                for name, weight in zip(region.variant_names, region.variant_weights) if name}
+
+    @property
+    def _table(self):
+        header = self.region.header
+        seq = int(header[_WEIGHTS_SEQ])
+        if seq != self._local_seq and seq % 2 == 0:
+            weights = self._read_weights()
+            if int(header[_WEIGHTS_SEQ]) == seq:  # No writer got in meanwhile
+                self._local_table = RoutingTable(weights, self.default_variant)
+                self._local_seq = seq
+        return self._local_table
+
+    @_table.setter
+    def _table(self, table):
+        """Publish a table to every worker. Callers hold the region lock."""
+        if len(table.weights) > MAX_VARIANTS:
+            raise ValueError(f"Shared routing supports at most {MAX_VARIANTS} variants")
+        entries = [(_encode_name(name), weight) for name, weight in table.weights.items()]
+
+        region = self.region
+        region.header[_WEIGHTS_SEQ] += 1  # Odd: readers keep their current table
+        region.variant_names.fill(b"")
+        region.variant_weights.fill(0)
+        for i, (name, weight) in enumerate(entries):
+            region.variant_names[i] = name
+            region.variant_weights[i] = weight
+        region.header[_WEIGHTS_SEQ] += 1
+
+        self._local_table = table
+        self._local_seq = int(region.header[_WEIGHTS_SEQ])
+
+
+class SharedFlags:
+    """Dict-like boolean control flags shared by every worker."""
+
+    def __init__(self, region, defaults):
+        self.region = region
+        with region.lock:
+            if not region.header[_FLAGS_SET]:
+                for name, value in defaults.items():
+                    region.header[_FLAGS + FLAG_NAMES.index(name)] = int(bool(value))
+                region.header[_FLAGS_SET] = 1
+
+    def __getitem__(self, name):
+        return bool(self.region.header[_FLAGS + FLAG_NAMES.index(name)])
+
+    def __setitem__(self, name, value):
+        index = FLAG_NAMES.index(name)
+        header = self.region.header
+        if value and not header[_FLAGS + index]:
+            header[_FLAGS_ON_MS + index] = int(time.time() * 1000)
+        header[_FLAGS + index] = int(bool(value))
+
+    def switched_on_at(self, name):
+        """time.time() when a flag was last switched on, or None if never."""
+        on_ms = int(self.region.header[_FLAGS_ON_MS + FLAG_NAMES.index(name)])
+        return on_ms / 1000 if on_ms else None
@@ -0,0 +1,111 @@
+"""
+stage_timing.py - Per-Stage Request Timing
+
+The single latency_ms reported by /predict covers routing and inference
+only. StageTimer splits a request into stages: each mark(stage) charges
+the time since the previous mark to that stage. It is a preallocated list
+of floats and a monotonic clock read per mark, cheap enough to run on
+every request.
+
+StageTimings aggregates finished timers into latency histograms per
+(model version, stage). Each model version has one preallocated flat list
+of bucket counters covering every stage; a finished request computes all
+its bucket indices first and then applies them in a single short update.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import threading
+import time
+
+from metrics_core import LatencyHistogram
+
+# Request stages in order. "queue" is the wait between parsing and the
+# start of routing (waiting for a thread under the async server).
+STAGES = ("parse", "queue", "route", "inference", "failure_sim", "metrics", "log", "serialize")
+PARSE, QUEUE, ROUTE, INFERENCE, FAILURE_SIM, METRICS, LOG, SERIALIZE = range(len(STAGES))
+COLUMNS = STAGES + ("total",)
+
+# Only used for its bucket layout; every summary histogram has the same one
+_LAYOUT = LatencyHistogram()
+_BUCKETS = len(_LAYOUT.counts)
+
+
+class StageTimer:
+    """Stopwatch for one request with a slot per stage."""
+
+    __slots__ = ("seconds", "started", "last")
+
+    def __init__(self):
+        self.seconds = [0.0] * len(STAGES)
+        self.started = self.last = time.perf_counter()
+
+    def mark(self, stage):
+        """Charge the time since the previous mark to `stage`."""
+        now = time.perf_counter()
+        self.seconds[stage] += now - self.last
+        self.last = now
+
+    def total_seconds(self):
+        return self.last - self.started
+
+
+class _VersionTimings:
+    """Bucket counters, sums and maxima for every stage of one model version."""
+
+    __slots__ = ("counts", "requests", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = [0] * (len(COLUMNS) * _BUCKETS)  # Column-major: stage, then bucket
+        self.requests = 0
+        self.total_ms = [0.0] * len(COLUMNS)
+        self.max_ms = [0.0] * len(COLUMNS)
+
+
+class StageTimings:
+    """Per-version, per-stage latency histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def record(self, model_version, timer):
+        values = [seconds * 1000 for seconds in timer.seconds]
+        values.append(timer.total_seconds() * 1000)
+        indices = [column * _BUCKETS + _LAYOUT._bucket_index(ms) for column, ms in enumerate(values)]
+
+        with self._lock:
+            timings = self._versions.get(model_version)
+            if timings is None:
+                timings = self._versions[model_version] = _VersionTimings()
+            counts, total_ms, max_ms = timings.counts, timings.total_ms, timings.max_ms
+            for index in indices:
+                counts[index] += 1
+            for column, ms in enumerate(values):
+                total_ms[column] += ms
+                if ms > max_ms[column]:
+                    max_ms[column] = ms
+            timings.requests += 1
+
+    def reset(self):
+        with self._lock:
+            self._versions = {}
+
+    def summary(self):
+        """{version: {stage: latency summary}} with stages in request order."""
+        with self._lock:
+            copies = {version: (list(t.counts), t.requests, list(t.total_ms), list(t.max_ms))
+                      for version, t in self._versions.items()}
+
+        result = {}
+        for model_version, (counts, requests, total_ms, max_ms) in sorted(copies.items()):
+            stages = result[model_version] = {}
+            for column, stage in enumerate(COLUMNS):
+                histogram = LatencyHistogram()
+                histogram.counts = counts[column * _BUCKETS:(column + 1) * _BUCKETS]
+                histogram.count = requests
+                histogram.total_ms = total_ms[column]
+                histogram.max_seen_ms = max_ms[column]
+                stages[stage] = histogram.summary(digits=3)
+        return result
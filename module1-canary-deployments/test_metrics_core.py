@@ -0,0 +1,30 @@
+"""
+test_metrics_core.py - Tests for the Shared Metrics Core
+
+Runs the concurrency stress test and checks that the copy of
+metrics_core.py in Lab 3 has not drifted from this one.
+
+Run with:  python -m pytest
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import os
+
+import metrics_core
+
+LAB3_COPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                         "module3-kubernetes-self-healing", "metrics_core.py")
+
+
+def test_lab3_copy_is_identical():
+    with open(metrics_core.__file__, "rb") as f:
+        ours = f.read()
+    with open(LAB3_COPY, "rb") as f:
+        theirs = f.read()
+    assert ours == theirs, "metrics_core.py differs between Lab 1 and Lab 3; copy the change to both"
+
+
+def test_concurrent_updates_are_exact():
+    assert metrics_core.stress_test()
@@ -0,0 +1,70 @@
+"""
+test_rollback_evaluator.py - Time-to-Detect Tests for the Rollback Evaluator
+
+Run with:  python -m pytest
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+from rollback_evaluator import RollbackEvaluator
+
+REQUESTS_PER_SECOND = 10
+START = 1_000_000.0
+
+
+def make_evaluator(rollbacks):
+    return RollbackEvaluator(on_rollback=lambda variant, reason, message: rollbacks.append(reason),
+                             accuracy_threshold=85, latency_threshold=500,
+                             window_seconds=60, window_buckets=12)
+
+
+def send(evaluator, start, seconds, accuracy_percent, rollbacks=None):
+    """
+    Record `seconds` of canary traffic at REQUESTS_PER_SECOND, evaluating
+    once a second. Returns the seconds until the first rollback, or None.
+    """
+    request = 0
+    for second in range(int(seconds)):
+        for _ in range(REQUESTS_PER_SECOND):
+            correct = request % 100 < accuracy_percent
+            evaluator.record("canary", correct, 20.0, now=start + second)
+            request += 1
+        evaluator.evaluate(now=start + second + 0.999)
+        if rollbacks:
+            return second + 1
+    return None
+
+
+def time_to_detect(good_history_seconds):
+    rollbacks = []
+    evaluator = make_evaluator(rollbacks)
+    assert send(evaluator, START, good_history_seconds, 95, rollbacks) is None
+    return send(evaluator, START + good_history_seconds, 120, 50, rollbacks)
+
+
+def test_long_good_history_does_not_slow_detection():
+    fresh = time_to_detect(0)
+    after_an_hour = time_to_detect(3600)
+    bucket_seconds = 60 / 12
+    assert fresh is not None and after_an_hour is not None
+    assert after_an_hour <= fresh + bucket_seconds
+    assert after_an_hour <= 10
+
+
+def test_good_canary_is_not_rolled_back():
+    rollbacks = []
+    assert send(make_evaluator(rollbacks), START, 3600, 95, rollbacks) is None
+    assert rollbacks == []
+
+
+def test_evidence_expires_with_the_window():
+    rollbacks = []
+    evaluator = make_evaluator(rollbacks)
+    # Bad, but not for long enough to cross the boundary
+    evaluator.record("canary", False, 20.0, now=START)
+    evaluator.record("canary", False, 20.0, now=START)
+    assert evaluator.status("canary", now=START)["accuracy_statistic"] > 0
+    evaluator.evaluate(now=START + 120)
+    assert evaluator.status("canary", now=START + 120)["accuracy_statistic"] == 0
+    assert rollbacks == []
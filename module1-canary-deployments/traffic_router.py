@@ -0,0 +1,128 @@
+"""
+traffic_router.py - N-Way Weighted, Sticky Traffic Router
+
+Routes each request to one of any number of model variants (production,
+canary, extra canaries...) in proportion to integer weights.
+
+Stickiness: when a request carries a routing key (e.g. a user id), the key
+is hashed to a fixed point in [0, 1). Each variant owns a slice of that
+interval sized by its weight, so the same key always lands on the same
+variant while the weights stay the same. Production's slice is always last,
+so raising a canary's weight only moves *additional* users onto it.
+Requests without a key are routed randomly with the same proportions.
+
+Weight changes build a new immutable RoutingTable and swap it in with a
+single assignment. The hot path reads self._table once and never locks.
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 1: Canary Deployments for ML Models
+"""
+
+import bisect
+import random
+import threading
+import zlib
+
+HASH_RESOLUTION = 10000  # Number of distinct points a routing key can hash to
+
+
+class RoutingTable:
+    """Immutable snapshot of variant weights, laid out for bisect lookups."""
+
+    __slots__ = ("weights", "variants", "cumulative", "total")
+
+    def __init__(self, weights, default_variant):
+        # Default (production) variant goes last so canary slices stay stable
+        ordered = sorted(weights.items(), key=lambda item: (item[0] == default_variant, item[0]))
+        ordered = [(name, weight) for name, weight in ordered if weight > 0]
+
+        self.weights = dict(weights)
+        self.variants = tuple(name for name, _ in ordered)
+        cumulative = []
+        running = 0
+        for _, weight in ordered:
+            running += weight
+            cumulative.append(running)
+        self.cumulative = tuple(cumulative)
+        self.total = running
+
+
+class WeightedRouter:
+    """Pick a variant per request from weights, sticky on an optional key."""
+
+    def __init__(self, weights, default_variant="production"):
+        self.default_variant = default_variant
+        self._write_lock = threading.Lock()  # Serializes writers only
+        self._table = RoutingTable(self._validate(weights), default_variant)
+
+    @staticmethod
+    def _validate(weights):
+        clean = {}
+        for name, weight in weights.items():
+            weight = int(weight)
+            if weight < 0:
+                raise ValueError(f"Weight for {name} must be >= 0")
+            clean[str(name)] = weight
+        return clean
+
+    def route(self, key=None):
+        """Return the variant for one request. Lock-free."""
+        table = self._table
+        if table.total == 0:
+            return self.default_variant
+
+        if key is None:
+            point = random.random() * table.total
+        else:
+            bucket = zlib.crc32(str(key).encode()) % HASH_RESOLUTION
+            point = bucket * table.total / HASH_RESOLUTION
+        return table.variants[bisect.bisect_right(table.cumulative, point)]
+
+    def weights(self):
+        return dict(self._table.weights)
+
+    def weight(self, variant):
+        return self._table.weights.get(variant, 0)
+
+    def set_weights(self, weights):
+        """Replace all weights atomically."""
+        table = RoutingTable(self._validate(weights), self.default_variant)
+        with self._write_lock:
+            self._table = table
+        return table.weights
+
+    def update_weights(self, changes):
+        """Change some weights, keeping the others, atomically."""
+        with self._write_lock:
+            weights = dict(self._table.weights)
+            weights.update(self._validate(changes))
+            self._table = RoutingTable(weights, self.default_variant)
+            return dict(weights)
+
+    def set_percentage(self, variant, percentage):
+        """
+        Give one variant a percentage of the current total weight. Other
+        non-default variants keep their weights while they fit in the rest
+        (and are scaled down together when they do not); the default
+        variant gets whatever is left.
+        """
+        percentage = min(100, max(0, int(percentage)))
+        with self._write_lock:
+            weights = dict(self._table.weights)
+            total = sum(weights.values())
+            if total < 100:
+                # Same proportions, fine enough for a whole percentage
+                scale = -(-100 // total) if total else 1
+                weights = {name: weight * scale for name, weight in weights.items()}
+                total = total * scale or 100
+            weights[variant] = round(total * percentage / 100)
+            remaining = total - weights[variant]
+            others = [name for name in weights if name not in (variant, self.default_variant)]
+            others_total = sum(weights[name] for name in others)
+            if others_total > remaining:
+                for name in others:
+                    weights[name] = weights[name] * remaining // others_total
+                others_total = sum(weights[name] for name in others)
+            weights[self.default_variant] = remaining - others_total
+            self._table = RoutingTable(weights, self.default_variant)
+            return dict(weights)
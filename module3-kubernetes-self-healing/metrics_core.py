@@ -0,0 +1,350 @@
+"""
+metrics_core.py - Thread-Safe, Contention-Free Metrics
+
+Shared by the canary router (Lab 1, app.py) and the model server (Lab 3,
+model_server.py). The two copies of this file must stay identical;
+module1-canary-deployments/test_metrics_core.py fails when they differ.
+
+LatencyHistogram
+  An HDR-style histogram with logarithmically spaced buckets. Memory stays
+  constant no matter how many latencies are recorded, percentiles come from
+  one walk over the buckets, and histograms with the same layout merge by
+  adding bucket counts.
+
+MetricsStore
+  Counters and latency histograms grouped into named series (e.g. one per
+  model version). Each thread writes only to the shard it holds, so updates
+  need no lock and can never be lost; reads merge all shards. A thread
+  hands its shard back to a free pool when it exits and the next new thread
+  takes it over, so a thread-per-request server allocates shards only up to
+  its peak concurrency and never merges on the request path. reset() swaps
+  in a fresh generation of shards with a single assignment.
+
+Concurrency stress test (also run by test_metrics_core.py):
+  python metrics_core.py
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+"""
+
+import math
+import threading
+
+# Bucket layout - every histogram built with the defaults is mergeable
+MIN_LATENCY_MS = 0.01       # Anything faster lands in the first bucket
+MAX_LATENCY_MS = 60000.0    # Anything slower lands in the last bucket
+RELATIVE_PRECISION = 0.02   # Each bucket is 2% wider than the previous one
+
+
+class LatencyHistogram:
+    """Streaming latency histogram reporting p50/p95/p99/max in O(buckets)."""
+
+    def __init__(self, min_ms=MIN_LATENCY_MS, max_ms=MAX_LATENCY_MS,
+                 precision=RELATIVE_PRECISION):
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.precision = precision
+        self._log_growth = math.log1p(precision)
+        num_buckets = int(math.ceil(math.log(max_ms / min_ms) / self._log_growth)) + 1
+        self.counts = [0] * num_buckets
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_seen_ms = 0.0
+
+    def _bucket_index(self, latency_ms):
+        if latency_ms <= self.min_ms:
+            return 0
+        index = int(math.log(latency_ms / self.min_ms) / self._log_growth) + 1
+        return min(index, len(self.counts) - 1)
+
+    def bucket_upper_bound(self, index):
+        """Upper edge (ms) of a bucket; used as the reported value for it."""
+        return self.min_ms * math.exp(index * self._log_growth)
+
+    def record(self, latency_ms):
+        """Add one latency observation. O(1), no allocation."""
+        self.counts[self._bucket_index(latency_ms)] += 1
+        self.count += 1
+        self.total_ms += latency_ms
+        if latency_ms > self.max_seen_ms:
+            self.max_seen_ms = latency_ms
+
+    def percentile(self, pct):
+        """Approximate latency at the given percentile (0-100)."""
+        if self.count == 0:
+            return 0.0
+        target = max(1, int(math.ceil(self.count * pct / 100.0)))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                # Never report more than the exact maximum we observed
+                return min(self.bucket_upper_bound(index), self.max_seen_ms)
+        return self.max_seen_ms
+
+    def mean(self):
+        return self.total_ms / self.count if self.count else 0.0
+
+    def merge(self, other):
+        """Add another histogram's observations into this one."""
+        if len(other.counts) != len(self.counts) or other.min_ms != self.min_ms:
+            raise ValueError("Cannot merge histograms with different bucket layouts")
+        for index, bucket_count in enumerate(other.counts):
+            if bucket_count:
+                self.counts[index] += bucket_count
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.max_seen_ms = max(self.max_seen_ms, other.max_seen_ms)
+        return self
+
+    def summary(self, digits=1):
+        """Return the latency fields exposed by /metrics."""
+        return {
+            "avg_latency_ms": round(self.mean(), digits),
+            "p50_latency_ms": round(self.percentile(50), digits),
+            "p95_latency_ms": round(self.percentile(95), digits),
+            "p99_latency_ms": round(self.percentile(99), digits),
+            "max_latency_ms": round(self.max_seen_ms, digits),
+        }
+
+
+class _Shard:
+    """Counters and histograms written by one thread at a time."""
+
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters = {}     # (series, epoch) -> {field: value}
+        self.histograms = {}   # (series, epoch) -> LatencyHistogram
+
+    def merge_into(self, counters, histograms, epochs):
+        """Add this shard's current-epoch data to the given dicts."""
+        for key, fields in list(self.counters.items()):
+            if key[1] != epochs.get(key[0], 0):
+                continue
+            target = counters.setdefault(key, {})
+            for field, value in list(fields.items()):
+                target[field] = target.get(field, 0) + value
+        for key, histogram in list(self.histograms.items()):
+            if key[1] != epochs.get(key[0], 0):
+                continue
+            histograms.setdefault(key, LatencyHistogram()).merge(histogram)
+
+    def drop_stale(self, series, epoch):
+        """Free a series' data from epochs before the given one."""
+        for table in (self.counters, self.histograms):
+            for key in [key for key in list(table) if key[0] == series and key[1] != epoch]:
+                table.pop(key, None)
+
+
+class _Lease:
+    """Kept in a thread's local storage; returns the shard to the pool when the thread exits."""
+
+    __slots__ = ("shard", "free")
+
+    def __init__(self, shard, free):
+        self.shard = shard
+        self.free = free
+
+    def __del__(self):
+        self.free.append(self.shard)
+
+
+class _Generation:
+    """All shards since the last reset()."""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []  # Every shard handed out; grows only with peak thread concurrency
+        self.free = []    # Shards of exited threads, ready for the next new thread
+
+
+class MetricsStore:
+    """Per-thread sharded counters and histograms, merged on read."""
+
+    def __init__(self):
+        self._generation = _Generation()
+        self._epochs = {}  # series -> epoch; bumping it resets one series
+        self._versions = {}  # series -> model version of its last reset_series()
+
+    def _shard(self):
+        generation = self._generation
+        lease = getattr(generation.local, "lease", None)
+        if lease is None:
+            # list.pop and list.append are atomic, so no lock is needed
+            try:
+                shard = generation.free.pop()
+            except IndexError:
+                shard = _Shard()
+                generation.shards.append(shard)
+            lease = generation.local.lease = _Lease(shard, generation.free)
+        return lease.shard
+
+    def _key(self, series):
+        return (series, self._epochs.get(series, 0))
+
+    # ---------- writes (lock-free) ----------
+
+    def record(self, series, latency_ms=None, **counts):
+        """Add counts (e.g. requests=1, correct=1) and optionally one latency."""
+        shard = self._shard()
+        key = self._key(series)
+        fields = shard.counters.get(key)
+        if fields is None:
+            fields = shard.counters[key] = {}
+        for field, amount in counts.items():
+            fields[field] = fields.get(field, 0) + amount
+        if latency_ms is not None:
+            histogram = shard.histograms.get(key)
+            if histogram is None:
+                histogram = shard.histograms[key] = LatencyHistogram()
+            histogram.record(latency_ms)
+
+    def inc(self, series, field, amount=1):
+        self.record(series, **{field: amount})
+
+    # ---------- reads ----------
+
+    def snapshot(self):
+        """
+        Merge every shard into {series: {"counters": {...}, "latency": LatencyHistogram}}.
+        Only the current epoch of each series is included.
+        """
+        epochs = self._epochs
+        counters, histograms = {}, {}
+        for shard in list(self._generation.shards):
+            shard.merge_into(counters, histograms, epochs)
+
+        result = {}
+        for key in set(counters) | set(histograms):
+            result[key[0]] = {
+                "counters": counters.get(key, {}),
+                "latency": histograms.get(key) or LatencyHistogram(),
+            }
+        return result
+
+    def series(self, series):
+        """Merged view of a single series (empty if it has no data)."""
+        return self.snapshot().get(series, {"counters": {}, "latency": LatencyHistogram()})
+
+    # ---------- resets ----------
+
+    def reset(self):
+        """Start over: new writes go to a fresh generation of shards."""
+        self._generation = _Generation()
+        self._epochs = {}
+        self._versions = {}
+
+    def reset_series(self, series, version=None):
+        """
+        Start one series over without touching the others. With a version,
+        a repeated call for the same version is ignored.
+        """
+        if version is not None:
+            if self._versions.get(series) == version:
+                return
+            self._versions[series] = version
+        epochs = dict(self._epochs)
+        epochs[series] = epochs.get(series, 0) + 1
+        self._epochs = epochs
+        # Older epochs are never read again; a write already in flight for
+        # one can leave an entry behind, which the next reset frees
+        for shard in list(self._generation.shards):
+            shard.drop_stale(series, epochs[series])
+
+
+# ============================================================
+# CONCURRENCY STRESS TEST
+# ============================================================
+def stress_test(threads=16, updates_per_thread=50000, readers=2, requests=20000):
+    """
+    Hammer one MetricsStore from many threads at once and check its totals
+    are exact while readers merge concurrently. Then replay a
+    thread-per-request server (a new short-lived thread for every request)
+    and check the totals are still exact and exited threads' shards were
+    reused instead of piling up.
+    """
+    import sys
+    import time
+
+    # Force very frequent thread switches to expose lost updates
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    store = MetricsStore()
+    start_barrier = threading.Barrier(threads + readers)
+    stop_readers = threading.Event()
+    reads = [0]
+
+    def writer(i):
+        start_barrier.wait()
+        for n in range(updates_per_thread):
+            store.record("stress", latency_ms=(n % 100) + 0.5, requests=1, correct=n % 2)
+
+    def reader():
+        start_barrier.wait()
+        while not stop_readers.is_set():
+            store.snapshot()
+            reads[0] += 1
+
+    workers = [threading.Thread(target=writer, args=(i,)) for i in range(threads)]
+    reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+    start = time.perf_counter()
+    for t in workers + reader_threads:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop_readers.set()
+    for t in reader_threads:
+        t.join()
+    sys.setswitchinterval(old_interval)
+
+    expected = threads * updates_per_thread
+    merged = store.series("stress")
+    counted = merged["counters"].get("requests", 0)
+    print(f"Threads: {threads} x {updates_per_thread} updates ({expected / elapsed:,.0f} updates/s, "
+          f"{reads[0]} concurrent snapshots)")
+    print(f"  requests:  {counted} (expected {expected})")
+    print(f"  correct:   {merged['counters'].get('correct', 0)} (expected {expected // 2})")
+    print(f"  latencies: {merged['latency'].count} (expected {expected})")
+    ok = (counted == expected and merged["latency"].count == expected
+          and merged["counters"].get("correct", 0) == expected // 2)
+
+    # Thread per request, at most `threads` running at once
+    store = MetricsStore()
+    slots = threading.Semaphore(threads)
+
+    def handle_request(n):
+        try:
+            store.record("churn", latency_ms=(n % 100) + 0.5, requests=1)
+        finally:
+            slots.release()
+
+    start = time.perf_counter()
+    for n in range(requests):
+        slots.acquire()
+        threading.Thread(target=handle_request, args=(n,)).start()
+    for _ in range(threads):
+        slots.acquire()
+    elapsed = time.perf_counter() - start
+
+    merged = store.series("churn")
+    counted = merged["counters"].get("requests", 0)
+    shards = len(store._generation.shards)
+    print(f"Thread per request: {requests} threads, at most {threads} at once "
+          f"({elapsed / requests * 1e6:.0f}us per request including thread start)")
+    print(f"  requests:  {counted} (expected {requests})")
+    print(f"  latencies: {merged['latency'].count} (expected {requests})")
+    print(f"  shards:    {shards} (at most {2 * threads})")
+    # A thread's shard goes back to the pool when its local storage is
+    # released, slightly after it frees its semaphore slot, hence 2x
+    ok = ok and counted == requests and merged["latency"].count == requests and shards <= 2 * threads
+
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(0 if stress_test() else 1)
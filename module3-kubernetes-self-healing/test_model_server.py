@@ -0,0 +1,83 @@
+"""
+test_model_server.py - Tests for the Model Server's Readiness and Probe Board
+
+Run with:  python -m pytest
+
+Part of: Harden AI - Patch and Recover Incidents Fast (Coursera)
+Lab 3: Kubernetes Self-Healing Systems
+"""
+
+import time
+
+from model_server import (LIVENESS_STALE_SECONDS, READINESS_WINDOW_SECONDS, READY_MAX_P95_MS,
+                          READY_MIN_REQUESTS, Metrics, ProbeBoard)
+
+
+def record_requests(metrics, count, latency_ms, now):
+    for _ in range(count):
+        metrics.recent.record(latency_ms, now=now)
+
+
+def test_starting_pod_without_traffic_is_ready():
+    ready, reason, _ = Metrics().check_readiness(now=1000.0)
+    assert ready
+    assert reason == "too few recent requests to judge"
+
+
+def test_unready_pod_stays_unready_when_its_window_empties():
+    metrics = Metrics()
+    now = 1000.0
+    record_requests(metrics, READY_MIN_REQUESTS * 2, READY_MAX_P95_MS * 3, now)
+    ready, reason, _ = metrics.check_readiness(now=now)
+    assert not ready
+    assert reason.startswith("p95 latency")
+
+    # Out of the Service: no more requests, the window empties
+    later = now + READINESS_WINDOW_SECONDS * 2
+    ready, reason, window = metrics.check_readiness(now=later)
+    assert window["requests"] == 0
+    assert not ready
+    assert reason == "too few recent requests to judge, staying not ready"
+
+
+def test_unready_pod_recovers_on_fast_requests():
+    metrics = Metrics()
+    now = 1000.0
+    record_requests(metrics, READY_MIN_REQUESTS * 2, READY_MAX_P95_MS * 3, now)
+    assert not metrics.check_readiness(now=now)[0]
+
+    later = now + READINESS_WINDOW_SECONDS * 2
+    record_requests(metrics, READY_MIN_REQUESTS * 2, 1.0, later)
+    ready, reason, _ = metrics.check_readiness(now=later)
+    assert ready
+    assert reason == "recovered below thresholds"
+
+
+def publish(board, published_at):
+    board.publish({'published_at': published_at,
+                   'probes': {'/health': [{'status': 'healthy'}, 200], '/ready': [{'status': 'ready'}, 200]}})
+
+
+def test_probe_board_read_does_not_hang_on_a_writer_that_died_mid_write():
+    board = ProbeBoard()
+    publish(board, time.monotonic())
+    assert board.read()['probes']['/health'][1] == 200
+
+    board._seq.value += 1  # Writer died after marking a write in progress
+    start = time.perf_counter()
+    answers = board.read()
+    assert time.perf_counter() - start < 0.5
+    assert answers['probes']['/health'][1] == 200  # Last answers decoded in full
+
+
+def test_probe_board_fails_probes_once_answers_are_stale():
+    board = ProbeBoard()
+    publish(board, time.monotonic() - LIVENESS_STALE_SECONDS - 1)
+    payload, status = board.answer('/health')
+    assert status == 503
+    assert payload['status'] == 'unhealthy'
+    assert board.answer('/ready')[1] == 503
+
+
+def test_probe_board_before_first_publish():
+    assert ProbeBoard().answer('/health')[1] == 503